@@ -3,19 +3,41 @@
 音频设备管理模块
 """
 
+import os
+import re
+import time
 import sounddevice as sd
 
+# hw:X,Y 格式的ALSA设备名
+_HW_RE = re.compile(r'hw:(\d+),(\d+)')
+_DEBUG = os.getenv('DEBUG', '').lower() in ('true', '1', 'yes')
+
 class AudioDeviceManager:
-    def __init__(self, target_device_name='ES7210'):
+    def __init__(self, target_device_name='ES7210', devices_cache_ttl=5.0):
         self.target_device_name = target_device_name
         self.audio_device_id = -1
+        
+        # 设备列表缓存，避免重复枚举PortAudio设备
+        self.devices_cache_ttl = devices_cache_ttl
+        self._devices = None
+        self._devices_cache_time = 0
+    
+    def _devices_cached(self):
+        """获取设备列表（带缓存，过期后重新枚举）"""
+        now = time.monotonic()
+        if self._devices is None or now - self._devices_cache_time > self.devices_cache_ttl:
+            self._devices = sd.query_devices()
+            self._devices_cache_time = now
+        return self._devices
+    
+    def refresh_devices(self):
+        """清除设备列表缓存，下次访问时重新枚举"""
+        self._devices = None
     
     def find_target_device(self):
         """自动查找目标音频设备，支持hw:X,Y格式"""
         try:
-            import os
-            import re
-            debug_mode = os.getenv('DEBUG', '').lower() in ['true', '1', 'yes']
+            debug_mode = _DEBUG
             
             if debug_mode:
                 print(f"正在查找设备: '{self.target_device_name}'")
@@ -23,20 +45,20 @@ class AudioDeviceManager:
             # 如果指定了 default，直接使用系统默认设备
             if self.target_device_name.lower() == 'default':
                 self.audio_device_id = sd.default.device[0]
-                devices = sd.query_devices()
+                devices = self._devices_cached()
                 default_dev = devices[self.audio_device_id]
                 if debug_mode:
                     print(f"✅ 使用系统默认设备: ID {self.audio_device_id} - {default_dev['name']}")
                 return self.audio_device_id
             
             # 检查是否是hw:X,Y格式
-            hw_match = re.match(r'hw:(\d+),(\d+)', self.target_device_name)
+            hw_match = _HW_RE.match(self.target_device_name)
             if hw_match:
                 # Linux ALSA设备格式
                 card_id, device_id = hw_match.groups()
                 alsa_device_name = f"hw:{card_id},{device_id}"
                 
-                devices = sd.query_devices()
+                devices = self._devices_cached()
                 for idx, dev in enumerate(devices):
                     # 查找包含hw:X,Y的设备名称
                     if (alsa_device_name in dev['name'] and 
@@ -59,7 +81,7 @@ class AudioDeviceManager:
                 if self.target_device_name.isdigit():
                     # 直接使用数字ID
                     device_id = int(self.target_device_name)
-                    devices = sd.query_devices()
+                    devices = self._devices_cached()
                     if 0 <= device_id < len(devices):
                         dev = devices[device_id]
                         if dev['max_input_channels'] > 0:
@@ -69,7 +91,7 @@ class AudioDeviceManager:
                             return device_id
                 else:
                     # 按名称搜索
-                    devices = sd.query_devices()
+                    devices = self._devices_cached()
                     for idx, dev in enumerate(devices):
                         if (self.target_device_name.lower() in dev['name'].lower() and 
                             dev['max_input_channels'] > 0):
@@ -80,7 +102,7 @@ class AudioDeviceManager:
             
             # 如果没找到，使用默认设备
             self.audio_device_id = sd.default.device[0]
-            devices = sd.query_devices()
+            devices = self._devices_cached()
             default_dev = devices[self.audio_device_id]
             if debug_mode:
                 print(f"⚠️ 未找到目标设备，使用默认设备: {default_dev['name']}")
@@ -94,10 +116,9 @@ class AudioDeviceManager:
     def list_audio_devices(self, current_device_id=None):
         """列出所有可用的输入音频设备"""
         try:
-            import re
             print("=== 可用音频输入设备列表 ===")
             
-            devices = sd.query_devices()
+            devices = self._devices_cached()
             input_count = 0
             
             for idx, dev in enumerate(devices):
@@ -108,7 +129,7 @@ class AudioDeviceManager:
                     
                     # 提取hw:X,Y格式（如果存在）
                     hw_info = ""
-                    hw_match = re.search(r'hw:(\d+),(\d+)', dev['name'])
+                    hw_match = _HW_RE.search(dev['name'])
                     if hw_match:
                         hw_info = f" (ALSA: {hw_match.group(0)})"
                     
@@ -128,7 +149,7 @@ class AudioDeviceManager:
     def get_device_info(self, device_id):
         """获取设备信息"""
         try:
-            devices = sd.query_devices()
+            devices = self._devices_cached()
             if 0 <= device_id < len(devices):
                 return devices[device_id]
             return None
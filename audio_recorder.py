@@ -9,11 +9,62 @@ import threading
 import time
 import queue
 import hashlib
+import heapq
 import json
+import os
+import struct
 from pathlib import Path
 from vad_processor import VADProcessor
 from speech_recognizer import SpeechRecognizer
 
+try:
+    import orjson  # 可选：更快的JSON编码
+except ImportError:
+    orjson = None
+
+try:
+    import xxhash  # 可选：更快的非加密哈希
+except ImportError:
+    xxhash = None
+
+class AudioBufferPool:
+    """语音段缓冲区池 - 预分配固定大小的缓冲区，复用语音段内存"""
+    
+    def __init__(self, num_buffers=4, buffer_bytes=16000 * 2 * 30):
+        """
+        初始化缓冲区池
+        
+        Args:
+            num_buffers: 缓冲区数量
+            buffer_bytes: 单个缓冲区字节数（默认可容纳30秒16kHz单声道int16）
+        """
+        self.buffer_bytes = buffer_bytes
+        self._storage = memoryview(bytearray(num_buffers * buffer_bytes))
+        self._free = list(range(num_buffers))
+        self._in_use = set()
+        self._lock = threading.Lock()
+    
+    def acquire(self, min_bytes):
+        """获取一个缓冲区，返回 (缓冲区ID, memoryview)；无可用缓冲区或长度超限时返回 (None, None)"""
+        if min_bytes > self.buffer_bytes:
+            return None, None
+        with self._lock:
+            if not self._free:
+                return None, None
+            buf_id = self._free.pop()
+            self._in_use.add(buf_id)
+        start = buf_id * self.buffer_bytes
+        return buf_id, self._storage[start:start + self.buffer_bytes]
+    
+    def release(self, buf_id):
+        """归还缓冲区（重复归还或None会被忽略）"""
+        if buf_id is None:
+            return
+        with self._lock:
+            if buf_id in self._in_use:
+                self._in_use.remove(buf_id)
+                self._free.append(buf_id)
+
 class AudioRecorder:
     def __init__(self, 
                  audio_device_id=0,
@@ -27,7 +78,8 @@ class AudioRecorder:
                  save_recordings=True,
                  recording_cache_dir="recording_cache",
                  max_cache_files=50,
-                 device="cpu"):
+                 device="cpu",
+                 asr_compile=False):
         """
         初始化音频录制器
         
@@ -44,6 +96,7 @@ class AudioRecorder:
             recording_cache_dir: 录制缓存目录 (新增)
             max_cache_files: 最大缓存文件数量 (新增)
             device: AI模型运行设备 (cpu/cuda:0/auto)
+            asr_compile: GPU上是否用torch.compile编译识别模型
         """
         # 音频参数
         self.audio_device_id = audio_device_id
@@ -62,16 +115,41 @@ class AudioRecorder:
         self.recording_cache_dir.mkdir(exist_ok=True)
         self.recording_cache_index_file = self.recording_cache_dir / "recording_index.json"
         self.recording_cache_index = self._load_recording_cache_index()
+        # 按创建时间排列的最小堆 (created, hash)，用于淘汰最旧的录制
+        self._cache_heap = [(info.get('created', 0), key) for key, info in self.recording_cache_index.items()]
+        heapq.heapify(self._cache_heap)
+        self._index_dirty = False  # 索引有未写盘的修改，由ASR线程空闲时或退出时统一写入
+        self._index_lock = threading.Lock()  # ASR线程与stop_recording共用同一临时文件，写盘需互斥
+        # 录制文件的WAV头模板（单声道16位），保存时只需填入两个长度字段
+        self._wav_header_tpl = struct.pack(
+            '<4sI4s4sIHHIIHH4sI',
+            b'RIFF', 0, b'WAVE', b'fmt ', 16, 1, 1,
+            samplerate, samplerate * 2, 2, 16,
+            b'data', 0
+        )
         
         # 状态变量
         self.recording_active = True
+        self._stop_event = threading.Event()  # stop_recording时置位，唤醒start_recording返回
         self.is_paused = False  # 暂停状态
         self.audio_stream = None  # 音频流引用
-        self.audio_buffer = []
-        self.last_active_time = time.time()
-        
-        # 线程锁
-        self._buffer_lock = threading.Lock()  # 保护音频缓冲区的线程锁
+        self.last_active_time = 0.0  # 流时间（秒），由已采集帧数推算
+        
+        # 预分配int16环形缓冲区，回调线程只做原地写入
+        # VAD窗口按整块对齐（约0.3秒），缓冲区容量为4个窗口，给VAD线程留出余量
+        self._vad_window_frames = int(np.ceil(0.3 * samplerate / blocksize)) * blocksize
+        self._ring = np.zeros((self._vad_window_frames * 4, channels), dtype=np.int16)
+        # 单生产者/单消费者索引（累计帧数，不取模）：回调线程只写_w，VAD线程只写_r
+        self._w = 0
+        self._r = 0
+        self._wake = threading.Event()  # 窗口就绪时唤醒VAD线程
+        # 每个音频块的峰值幅度（在回调中由float32数据直接计算，按块号存放）
+        self._block_peaks = np.zeros(len(self._ring) // blocksize, dtype=np.float32)
+        # 回调线程的float32转换暂存区，转换结果直接写入环形缓冲区
+        self._scratch_f32 = np.empty((blocksize, channels), dtype=np.float32)
+        
+        # 日志队列：音频/VAD路径的输出交给日志线程打印，避免终端IO阻塞
+        self._log_q = queue.Queue()
         
         # 录制统计
         self.recording_stats = {
@@ -83,7 +161,7 @@ class AudioRecorder:
         }
         
         # 语音录制状态
-        self.speech_segments = []
+        self.speech_segments = bytearray()  # 当前语音段的原始音频（连续追加）
         self.is_recording_speech = False
         self.speech_start_time = None
         self.is_processing = False
@@ -91,6 +169,7 @@ class AudioRecorder:
         
         # 控制待机状态显示
         self.show_standby_status = True
+        self._last_standby_print = 0.0  # 待机状态每秒最多刷新一次
         
         # 连续语音检测计数器 (减少误触发)
         self.consecutive_speech_count = 0
@@ -106,13 +185,17 @@ class AudioRecorder:
         # 初始化语音识别器
         self.speech_recognizer = None
         if enable_asr:
-            self.speech_recognizer = SpeechRecognizer(samplerate=samplerate, device=device)
+            self.speech_recognizer = SpeechRecognizer(samplerate=samplerate, device=device,
+                                                     compile_model=asr_compile)
             if not self.speech_recognizer.is_model_loaded():
                 self.enable_asr = False
         
         # ASR队列管理
         self.asr_queue = queue.Queue(maxsize=asr_queue_size)
+        # 语音段缓冲区池（单声道int16），池满或语音过长时回退为普通分配
+        self.audio_pool = AudioBufferPool(buffer_bytes=samplerate * 2 * 30)
         self.asr_consumer_active = True
+        self.asr_batch_size = 4  # 每批最多合并识别的语音段数
         self.asr_stats = {
             'queued': 0,
             'processed': 0,
@@ -136,6 +219,8 @@ class AudioRecorder:
         """加载录制缓存索引"""
         try:
             if self.recording_cache_index_file.exists():
+                if orjson is not None:
+                    return orjson.loads(self.recording_cache_index_file.read_bytes())
                 with open(self.recording_cache_index_file, 'r', encoding='utf-8') as f:
                     return json.load(f)
         except Exception as e:
@@ -143,16 +228,30 @@ class AudioRecorder:
         return {}
     
     def _save_recording_cache_index(self):
-        """保存录制缓存索引"""
+        """保存录制缓存索引（写入临时文件后原子替换）"""
         try:
-            with open(self.recording_cache_index_file, 'w', encoding='utf-8') as f:
-                json.dump(self.recording_cache_index, f, ensure_ascii=False, indent=2)
+            tmp_file = self.recording_cache_index_file.with_suffix('.json.tmp')
+            if orjson is not None:
+                tmp_file.write_bytes(orjson.dumps(self.recording_cache_index))
+            else:
+                with open(tmp_file, 'w', encoding='utf-8') as f:
+                    json.dump(self.recording_cache_index, f, ensure_ascii=False, separators=(',', ':'))
+            os.replace(tmp_file, self.recording_cache_index_file)
+            self._index_dirty = False
         except Exception as e:
             print(f"⚠️ 保存录制缓存索引失败: {e}")
     
+    def _flush_index_if_dirty(self):
+        """如果索引有未保存的修改则写盘"""
+        with self._index_lock:
+            if self._index_dirty:
+                self._save_recording_cache_index()
+    
     def _get_recording_hash(self, audio_data: bytes) -> str:
         """生成录制音频的哈希值"""
-        # 使用音频数据的MD5哈希作为唯一标识
+        # 哈希仅用作内容标识，优先使用xxh3，未安装时回退到MD5
+        if xxhash is not None:
+            return xxhash.xxh3_128_hexdigest(audio_data)
         return hashlib.md5(audio_data).hexdigest()
     
     def _cleanup_recording_cache(self):
@@ -160,15 +259,13 @@ class AudioRecorder:
         if len(self.recording_cache_index) <= self.max_cache_files:
             return
         
-        # 按创建时间排序，删除最旧的文件
-        sorted_items = sorted(
-            self.recording_cache_index.items(),
-            key=lambda x: x[1].get('created', 0)
-        )
-        
-        files_to_remove = len(self.recording_cache_index) - self.max_cache_files
-        for i in range(files_to_remove):
-            hash_key, file_info = sorted_items[i]
+        # 从最小堆中依次弹出最旧的文件
+        while len(self.recording_cache_index) > self.max_cache_files and self._cache_heap:
+            created, hash_key = heapq.heappop(self._cache_heap)
+            file_info = self.recording_cache_index.get(hash_key)
+            # 跳过已删除或已被覆盖的过期堆条目
+            if file_info is None or file_info.get('created', 0) != created:
+                continue
             file_path = self.recording_cache_dir / file_info['filename']
             
             try:
@@ -176,15 +273,15 @@ class AudioRecorder:
                     file_path.unlink()
                     # 静默删除旧录制
                     pass
-                del self.recording_cache_index[hash_key]
             except Exception as e:
                 # 静默处理删除失败
                 pass
+            del self.recording_cache_index[hash_key]
         
-        self._save_recording_cache_index()
+        self._index_dirty = True
         # 静默完成清理
     
-    def _save_recording_file(self, audio_data: bytes, recognized_text: str = None) -> str:
+    def _save_recording_file(self, audio_data: np.ndarray, recognized_text: str = None) -> str:
         """保存录制文件并返回文件路径"""
         if not self.save_recordings:
             return None
@@ -196,12 +293,19 @@ class AudioRecorder:
             filename = f"rec_{timestamp}_{audio_hash[:8]}.wav"
             file_path = self.recording_cache_dir / filename
             
-            # 保存WAV文件
-            if self.speech_recognizer:
-                self.speech_recognizer.save_wav_file(str(file_path), audio_data)
-            
             # 计算实际音频时长（包含静音段）
-            actual_duration = len(audio_data) / (self.samplerate * 2)  # 总时长（包含静音）
+            audio_bytes = audio_data.nbytes if isinstance(audio_data, np.ndarray) else len(audio_data)
+            
+            # 保存WAV文件：填充头模板中的长度字段后直接写入音频数据
+            header = bytearray(self._wav_header_tpl)
+            struct.pack_into('<I', header, 4, 36 + audio_bytes)
+            struct.pack_into('<I', header, 40, audio_bytes)
+            if isinstance(audio_data, np.ndarray):
+                audio_data = np.ascontiguousarray(audio_data, dtype='<i2')
+            with open(file_path, 'wb') as f:
+                f.write(header)
+                f.write(audio_data)
+            actual_duration = audio_bytes / (self.samplerate * 2)  # 总时长（包含静音）
             
             # 更新缓存索引
             self.recording_cache_index[audio_hash] = {
@@ -210,14 +314,15 @@ class AudioRecorder:
                 'text': recognized_text or "未识别",
                 'duration': actual_duration,  # 实际录制时长（包含静音）
                 'speech_duration': getattr(self, 'actual_speech_duration', 0),  # 纯语音时长
-                'size': len(audio_data),
+                'size': audio_bytes,
                 'recognition_success': recognized_text is not None,
                 'contains_silence': True  # 标记包含静音段
             }
+            heapq.heappush(self._cache_heap, (timestamp, audio_hash))
             
-            # 清理旧缓存
+            # 清理旧缓存，索引延迟到ASR线程空闲时写盘
             self._cleanup_recording_cache()
-            self._save_recording_cache_index()
+            self._index_dirty = True
             
             # 更新统计
             self.recording_stats['total_recordings'] += 1
@@ -239,8 +344,9 @@ class AudioRecorder:
     def find_recording_by_text(self, text: str) -> list:
         """根据识别文本查找录制文件"""
         results = []
+        text = text.lower()
         for hash_key, file_info in self.recording_cache_index.items():
-            if text.lower() in file_info.get('text', '').lower():
+            if text in file_info.get('text', '').lower():
                 file_path = self.recording_cache_dir / file_info['filename']
                 if file_path.exists():
                     results.append({
@@ -252,6 +358,16 @@ class AudioRecorder:
                     })
         return results
     
+    def _log(self, msg, end="\n"):
+        """将输出放入日志队列，由日志线程统一打印"""
+        self._log_q.put_nowait((msg, end))
+    
+    def _log_worker(self):
+        """日志线程 - 依次打印日志队列中的消息"""
+        while True:
+            msg, end = self._log_q.get()
+            print(msg, end=end, flush=True)
+    
     def set_callbacks(self, on_speech=None, on_silence=None, on_recognition=None):
         """设置回调函数"""
         self.on_speech_detected = on_speech
@@ -259,68 +375,103 @@ class AudioRecorder:
         self.on_recognition_result = on_recognition
     
     def audio_callback(self, indata, frames, time_info, status):
-        """音频数据回调函数"""
+        """音频数据回调函数 - 仅写入环形缓冲区，VAD处理交给VAD线程"""
         if status:
-            print(f"⚠️ 音频状态警告: {status}")
-        
-        # 如果暂停，清空缓冲区并返回，不处理音频数据
-        if self.is_paused:
-            with self._buffer_lock:
-                self.audio_buffer.clear()
-            return
+            self._log(f"⚠️ 音频状态警告: {status}")
         
         if self.recording_active:
             try:
-                # 正确的音频格式转换方式 - 避免音质损失
-                # 确保输入数据是正确的格式
+                n = len(indata)
+                if n > len(self._scratch_f32):
+                    self._scratch_f32 = np.empty((n, self.channels), dtype=np.float32)
+                scratch = self._scratch_f32[:n]
                 if indata.ndim == 1:
-                    # 单声道数据，扩展为双声道
-                    audio_array = np.column_stack((indata, indata))
+                    # 单声道数据，广播到所有声道
+                    scratch[:] = indata[:, np.newaxis]
                 else:
-                    audio_array = indata
+                    np.copyto(scratch, indata)
                 
-                # 限制范围到[-1, 1]然后转换为int16，避免溢出和音质损失
-                audio_clipped = np.clip(audio_array, -1.0, 1.0)
-                audio_data = (audio_clipped * 32767).astype(np.int16).tobytes()
+                # 原地限制范围到[-1, 1]并缩放取整，避免溢出和音质损失
+                np.clip(scratch, -1.0, 1.0, out=scratch)
+                peak = max(float(scratch.max()), -float(scratch.min()))
+                np.multiply(scratch, 32767.0, out=scratch)
+                np.rint(scratch, out=scratch)
                 
-                # 添加到缓冲区
-                self.audio_buffer.append(audio_data)
+                # 转换为int16写入环形缓冲区（到达末尾时分两段写入）
+                capacity = len(self._ring)
+                w = self._w
+                pos = w % capacity
+                first = min(n, capacity - pos)
+                np.copyto(self._ring[pos:pos + first], scratch[:first], casting='unsafe')
+                if first < n:
+                    np.copyto(self._ring[:n - first], scratch[first:], casting='unsafe')
+                self._block_peaks[(w // self.blocksize) % len(self._block_peaks)] = peak
+                # 数据写完后再发布写索引
+                self._w = w + n
                 
-                # 每0.3秒检测一次VAD
-                buffer_duration = len(self.audio_buffer) * self.blocksize / self.samplerate
-                if buffer_duration >= 0.3:
-                    self.process_audio_buffer()
+                # 每0.3秒唤醒VAD线程检测一次
+                if self._w - self._r >= self._vad_window_frames:
+                    self._wake.set()
+            
+            except Exception as e:
+                self._log(f"❌ 音频回调处理错误: {e}")
+    
+    def _vad_worker(self):
+        """VAD线程 - 等待环形缓冲区凑满一个窗口后进行处理"""
+        while self.recording_active:
+            if not self._wake.wait(timeout=0.5):
+                continue
+            self._wake.clear()
             
+            try:
+                self.process_audio_buffer()
             except Exception as e:
-                print(f"❌ 音频回调处理错误: {e}")
+                self._log(f"❌ VAD处理错误: {e}")
     
     def process_audio_buffer(self):
         """处理音频缓冲区"""
-        # 如果暂停，不处理音频缓冲区
+        # 读取写索引快照
+        w = self._w
+        
+        # 如果暂停，丢弃未处理的音频
         if self.is_paused:
+            self._r = w
             return
             
-        # 拼接音频数据并检测VAD
-        with self._buffer_lock:
-            raw_audio = b''.join(self.audio_buffer)
+        # 取出未处理的音频窗口（落后超过缓冲区容量时只取最近的数据）
+        capacity = len(self._ring)
+        fill = min(w - self._r, capacity)
+        if fill < self._vad_window_frames:
+            return
+        self._r = w
         
-        # 转换为单声道（用于保存录制文件）
-        if self.channels == 1:
-            mono_audio = raw_audio
+        start = (w - fill) % capacity
+        end = w % capacity
+        if start < end:
+            window = self._ring[start:end]
         else:
-            mono_audio = self.vad_processor.stereo_to_mono(raw_audio)
-        
-        vad_result, speech_chunks, total_chunks = self.vad_processor.check_vad_activity(raw_audio)
-        
-        # 计算音频幅度
-        amplitude = self.vad_processor.calculate_audio_amplitude(raw_audio)
+            window = np.concatenate((self._ring[start:], self._ring[:end]))
+        raw_audio = np.ascontiguousarray(window).tobytes()
         
-        # 获取当前时间
-        current_time = time.time()
+        # 窗口内各块峰值的最大值即为音频幅度
+        first_block = (w - fill) // self.blocksize
+        last_block = (w - 1) // self.blocksize
+        slots = np.arange(first_block, last_block + 1) % len(self._block_peaks)
+        amplitude = float(self._block_peaks[slots].max())
         
         # 增加幅度阈值过滤，减少误触发 (调整这个值来控制敏感度)
         amplitude_threshold = 0.1  # 幅度阈值，低于此值的音频不会触发录制（可配置参数）
         
+        if amplitude > amplitude_threshold:
+            vad_result, speech_chunks, total_chunks = self.vad_processor.check_vad_activity(raw_audio)
+        else:
+            # 幅度未达阈值时必然按静音处理，跳过VAD检测（待机时的常见情况）
+            vad_result, speech_chunks = False, 0
+            total_chunks = fill // int(self.samplerate * 0.02)
+        
+        # 获取当前流时间：由已写入的帧数推算，与窗口数据严格对应且无需系统调用
+        current_time = w / self.samplerate
+        
         if vad_result and amplitude > amplitude_threshold:
             self.consecutive_speech_count += 1
             
@@ -329,10 +480,10 @@ class AudioRecorder:
                 if self.consecutive_speech_count >= self.speech_confirmation_threshold:
                     self.is_recording_speech = True
                     self.speech_start_time = current_time
-                    self.speech_segments = []
+                    self.speech_segments.clear()
                     self.actual_speech_duration = 0.0
                     self.show_standby_status = False  # 停止显示待机状态
-                    print(f"\r\n🔴 开始录制语音段", flush=True)
+                    self._log(f"\r\n🔴 开始录制语音段")
                 else:
                     return  # 还未确认，不开始录制
             
@@ -340,7 +491,7 @@ class AudioRecorder:
             self.last_active_time = current_time
             
             # 添加原始双声道音频段到语音录制（保持原始音质）
-            self.speech_segments.append(raw_audio)
+            self.speech_segments.extend(raw_audio)
             self.actual_speech_duration += 0.3
             
             # 调用回调函数
@@ -351,12 +502,14 @@ class AudioRecorder:
             self.consecutive_speech_count = 0
             
             # 只在未录制时显示待机状态
-            if not self.is_recording_speech and self.show_standby_status:
-                print(f"\r🔇 待机中 - 幅度: {amplitude:.4f}, 语音块: {speech_chunks}/{total_chunks}                    ", end="", flush=True)
+            if (not self.is_recording_speech and self.show_standby_status
+                    and current_time - self._last_standby_print > 1.0):
+                self._last_standby_print = current_time
+                self._log(f"\r🔇 待机中 - 幅度: {amplitude:.4f}, 语音块: {speech_chunks}/{total_chunks}                    ", end="")
             
             # 静音时也添加音频段，保持完整的录制上下文
             if self.is_recording_speech:
-                self.speech_segments.append(raw_audio)  # 添加静音段到录制（保持原始双声道）
+                self.speech_segments.extend(raw_audio)  # 添加静音段到录制（保持原始双声道）
                 # 注意：静音段不增加actual_speech_duration，但会增加总录制时长
             
             # 调用回调函数
@@ -377,8 +530,8 @@ class AudioRecorder:
             else:
                 # 短语音统计
                 self.recording_stats['short_recordings'] += 1
-                print(f"\r\n⏭️ 语音过短 [{self.actual_speech_duration:.1f}s/{self.min_speech_duration}s] 已跳过")
-                print("-" * 50)  # 分割线
+                self._log(f"\r\n⏭️ 语音过短 [{self.actual_speech_duration:.1f}s/{self.min_speech_duration}s] 已跳过")
+                self._log("-" * 50)  # 分割线
                 self.speech_segments.clear()
             
             self.is_recording_speech = False
@@ -388,10 +541,6 @@ class AudioRecorder:
             # 如果是短语音跳过，show_standby_status应该为True
             if not self.is_paused:  # 如果没有暂停（短语音情况），恢复待机状态显示
                 self.show_standby_status = True
-        
-        # 处理完成后清空缓冲区
-        with self._buffer_lock:
-            self.audio_buffer.clear()  # 使用clear()更安全
     
     def process_speech_segments(self):
         """处理和保存语音段"""
@@ -401,20 +550,26 @@ class AudioRecorder:
         self.is_processing = True
         
         try:
-            # 合并所有语音段
-            combined_audio = b''.join(self.speech_segments)
-            
-            # 转换为单声道
-            mono_audio = self.vad_processor.stereo_to_mono(combined_audio)
+            # 取左声道转换为单声道，直接写入缓冲区池中的缓冲区
+            # 单声道数据以int16数组形式一路传给ASR和WAV写入，不再来回转换bytes
+            samples = np.frombuffer(self.speech_segments, dtype=np.int16).reshape(-1, self.channels)[:, 0]
+            buf_id, buf = self.audio_pool.acquire(samples.size * 2)
+            if buf is not None:
+                mono_audio = np.frombuffer(buf, dtype=np.int16, count=samples.size)
+                mono_audio[:] = samples
+            else:
+                mono_audio = samples.copy()
+            del samples  # 释放对speech_segments的引用，之后才能清空
             
             # 计算音频信息
-            audio_length = len(mono_audio) / (self.samplerate * 2)  # 2字节per sample
+            audio_length = mono_audio.size / self.samplerate
             
             # 如果启用语音识别，加入队列进行识别
             if self.enable_asr and self.speech_recognizer:
                 try:
-                    audio_item = (mono_audio, audio_length, self.actual_speech_duration)
-                    self.asr_queue.put_nowait(audio_item)
+                    audio_item = (buf_id, mono_audio, audio_length, self.actual_speech_duration)
+                    # 队列满时短暂阻塞等待ASR线程消费，超时才丢弃
+                    self.asr_queue.put(audio_item, timeout=0.5)
                     
                     self.asr_stats['queued'] += 1
                     queue_size = self.asr_queue.qsize()
@@ -422,20 +577,22 @@ class AudioRecorder:
                     # 音频段已加入队列（内部调试信息，不显示）
                     
                 except queue.Full:
+                    self.audio_pool.release(buf_id)
                     self.asr_stats['dropped'] += 1
-                    print(f"⚠️ ASR队列已满，丢弃当前音频段 (时长: {audio_length:.1f}s)")
+                    self._log(f"⚠️ ASR队列已满，丢弃当前音频段 (时长: {audio_length:.1f}s)")
             else:
                 # 保存文件用于调试
                 timestamp = time.strftime("%Y%m%d_%H%M%S")
                 filename = f"speech_vad_{timestamp}.wav"
                 self.speech_recognizer.save_wav_file(filename, mono_audio)
-                print(f"💾 语音文件已保存: {filename} (时长: {audio_length:.1f}s)")
+                self.audio_pool.release(buf_id)
+                self._log(f"💾 语音文件已保存: {filename} (时长: {audio_length:.1f}s)")
             
             # 清空语音段缓存
             self.speech_segments.clear()
             
         except Exception as e:
-            print(f"❌ 处理语音段失败: {e}")
+            self._log(f"❌ 处理语音段失败: {e}")
         finally:
             self.is_processing = False
     
@@ -444,68 +601,104 @@ class AudioRecorder:
         # ASR消费者线程开始工作
         
         while self.asr_consumer_active:
+            batch = []
+            handled = 0  # 已交给结果处理的条数，其缓冲区由结果处理负责归还
+            stop_requested = False
             try:
                 audio_item = self.asr_queue.get(timeout=1.0)
                 
                 if audio_item is None:  # 结束信号
                     break
+                batch.append(audio_item)
                 
-                audio_data, audio_length, actual_speech_duration = audio_item
+                # 非阻塞取出已排队的语音段，合并为一批识别
+                while len(batch) < self.asr_batch_size:
+                    try:
+                        audio_item = self.asr_queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if audio_item is None:  # 结束信号，处理完本批后退出
+                        stop_requested = True
+                        break
+                    batch.append(audio_item)
                 
-                self.asr_stats['processed'] += 1
+                self.asr_stats['processed'] += len(batch)
                 queue_size = self.asr_queue.qsize()
                 
                 # 不显示识别中状态，保持简洁
                 
-                # 执行语音识别
-                recognized_text = self.speech_recognizer.recognize_from_memory(audio_data)
+                # 执行语音识别（整批识别完成后再进行文件保存等IO）
+                audio_list = [item[1] for item in batch]
+                recognized_texts = self.speech_recognizer.recognize_batch(audio_list)
+                del audio_list
                 
-                # 保存录制文件（与识别结果关联）
-                recording_file = self._save_recording_file(audio_data, recognized_text)
-                
-                # 显示录制文件保存结果
-                if recording_file:
-                    from pathlib import Path
-                    filename = Path(recording_file).name
-                    if recognized_text and recognized_text.strip():
-                        # 识别成功，显示录制完成和识别结果
-                        print(f"\r⏹️ 录制完成 ({audio_length:.1f}s) -> {filename}")
-                        print(f"🎙️ 语音识别: {recognized_text}")
-                    else:
-                        # 识别失败
-                        self.recording_stats['failed_recognitions'] += 1
-                        print(f"\r❌ 识别失败 -> {filename} ({audio_length:.1f}s)")
-                        print("⚠️ 语音识别失败，但已保存录制文件以供调试")
-                        print("-" * 50)  # 分割线
-                        # 识别失败时恢复录制
-                        self._ensure_recording_resumed()
-                
-                # 调用识别结果回调，传递录制文件路径
-                if recognized_text and recognized_text.strip() and self.on_recognition_result:
-                    # 如果回调函数支持录制文件参数，传递它
+                for (buf_id, audio_data, audio_length, _), recognized_text in zip(batch, recognized_texts):
+                    handled += 1
                     try:
-                        # 尝试传递额外参数
-                        self.on_recognition_result(recognized_text, recording_file=recording_file)
-                    except TypeError:
-                        # 如果不支持额外参数，使用原始方式
-                        self.on_recognition_result(recognized_text)
+                        self._handle_recognition_result(buf_id, audio_data, audio_length, recognized_text)
+                    finally:
+                        self.asr_queue.task_done()
                 
-                self.asr_queue.task_done()
+                if stop_requested:
+                    break
                 
             except queue.Empty:
+                # 空闲时写入积累的索引修改
+                self._flush_index_if_dirty()
                 continue
             except Exception as e:
-                print(f"❌ ASR消费者线程错误: {e}")
+                # 只归还尚未处理的缓冲区：已处理的可能已被VAD线程重新取用
+                for item in batch[handled:]:
+                    self.audio_pool.release(item[0])
+                    self.asr_queue.task_done()
+                self._log(f"❌ ASR消费者线程错误: {e}")
                 # ASR异常时恢复录制
                 self._ensure_recording_resumed()
                 # 检查是否是关键错误
                 if "memory" in str(e).lower() or "model" in str(e).lower():
-                    print("🚨 检测到关键错误，停止ASR处理")
+                    self._log("🚨 检测到关键错误，停止ASR处理")
                     self.asr_consumer_active = False
                     break
                 time.sleep(0.5)
         
-        # ASR消费者线程结束
+        # ASR消费者线程结束，写入最后一批识别产生的索引修改
+        self._flush_index_if_dirty()
+    
+    def _handle_recognition_result(self, buf_id, audio_data, audio_length, recognized_text):
+        """保存录制文件、显示识别结果并调用回调"""
+        try:
+            # 保存录制文件（与识别结果关联）
+            recording_file = self._save_recording_file(audio_data, recognized_text)
+        finally:
+            # 音频已识别并保存，归还缓冲区（保存失败也归还，调用方不再重复归还）
+            del audio_data
+            self.audio_pool.release(buf_id)
+        
+        # 显示录制文件保存结果
+        if recording_file:
+            filename = Path(recording_file).name
+            if recognized_text and recognized_text.strip():
+                # 识别成功，显示录制完成和识别结果
+                self._log(f"\r⏹️ 录制完成 ({audio_length:.1f}s) -> {filename}")
+                self._log(f"🎙️ 语音识别: {recognized_text}")
+            else:
+                # 识别失败
+                self.recording_stats['failed_recognitions'] += 1
+                self._log(f"\r❌ 识别失败 -> {filename} ({audio_length:.1f}s)")
+                self._log("⚠️ 语音识别失败，但已保存录制文件以供调试")
+                self._log("-" * 50)  # 分割线
+                # 识别失败时恢复录制
+                self._ensure_recording_resumed()
+        
+        # 调用识别结果回调，传递录制文件路径
+        if recognized_text and recognized_text.strip() and self.on_recognition_result:
+            # 如果回调函数支持录制文件参数，传递它
+            try:
+                # 尝试传递额外参数
+                self.on_recognition_result(recognized_text, recording_file=recording_file)
+            except TypeError:
+                # 如果不支持额外参数，使用原始方式
+                self.on_recognition_result(recognized_text)
     
     def pause_recording(self):
         """暂停录制（保持音频流，但停止处理）"""
@@ -531,6 +724,16 @@ class AudioRecorder:
         try:
             # 开始音频VAD监听
             
+            # 启动日志线程
+            self.log_thread = threading.Thread(target=self._log_worker)
+            self.log_thread.daemon = True
+            self.log_thread.start()
+            
+            # 启动VAD线程
+            self.vad_thread = threading.Thread(target=self._vad_worker)
+            self.vad_thread.daemon = True
+            self.vad_thread.start()
+            
             # 启动ASR消费者线程
             if self.enable_asr:
                 self.asr_thread = threading.Thread(target=self.asr_consumer_worker)
@@ -549,9 +752,8 @@ class AudioRecorder:
             )
             
             with self.audio_stream:
-                # 持续监听
-                while self.recording_active:
-                    time.sleep(0.1)
+                # 持续监听，阻塞直到stop_recording置位事件
+                self._stop_event.wait()
             
         except Exception as e:
             print(f'❌ 音频VAD监听错误: {e}')
@@ -559,6 +761,8 @@ class AudioRecorder:
     def stop_recording(self):
         """停止录制"""
         self.recording_active = False
+        self._wake.set()  # 唤醒VAD线程使其退出
+        self._stop_event.set()  # 唤醒start_recording的监听等待
         # VAD监听停止
         
         # 安全关闭音频流
@@ -581,3 +785,7 @@ class AudioRecorder:
                 print("⚠️ ASR队列已满，强制停止")
             except Exception as e:
                 print(f"⚠️ 停止ASR线程失败: {e}")
+        
+        # 写入尚未保存的录制索引（ASR线程仍在运行时由其退出时写入，避免并发写盘）
+        if not (hasattr(self, 'asr_thread') and self.asr_thread.is_alive()):
+            self._flush_index_if_dirty()
@@ -4,12 +4,56 @@
 帮助用户查找和测试音频设备
 """
 
-import sounddevice as sd
-import numpy as np
+# sounddevice/numpy 在用到时才导入，查看用法等命令无需初始化PortAudio
+import queue
 import sys
+import threading
 import time
 from pathlib import Path
 
+# 设备列表缓存（枚举设备较慢，且频繁枚举在部分平台上不稳定）
+_DEVICES_CACHE_TTL = 5.0  # 秒，过期后重新枚举以感知热插拔
+_DEVICES_CACHE = None
+_DEVICES_CACHE_TIME = 0.0
+_DEFAULTS_CACHE = None
+
+# 设备表头（预先格式化）
+HDR_ALL = f"{'ID':<4} {'名称':<30} {'类型':<8} {'声道':<8} {'采样率'}"
+HDR_IO = f"{'ID':<4} {'名称':<60} {'声道数':<8} {'采样率'}"
+RULE_ALL = "-" * 60
+RULE_IO = "-" * 80
+
+# 设备类型标签，按 (有输入, 有输出) 查表
+_TYPE_LABEL = {
+    (False, False): "",
+    (True, False): "输入 ",
+    (False, True): "输出",
+    (True, True): "输入 输出",
+}
+
+# 播放测试音频缓存（连续float32立体声，避免重复生成）
+_TEST_TONE = None
+
+def _get_devices():
+    """获取设备列表（带缓存）"""
+    import sounddevice as sd
+    global _DEVICES_CACHE, _DEVICES_CACHE_TIME, _DEFAULTS_CACHE
+    now = time.monotonic()
+    if _DEVICES_CACHE is None or now - _DEVICES_CACHE_TIME > _DEVICES_CACHE_TTL:
+        _DEVICES_CACHE = sd.query_devices()
+        _DEVICES_CACHE_TIME = now
+        _DEFAULTS_CACHE = None
+    return _DEVICES_CACHE
+
+def _get_defaults():
+    """获取默认(输入, 输出)设备ID（随设备列表一同缓存）"""
+    import sounddevice as sd
+    global _DEFAULTS_CACHE
+    _get_devices()
+    if _DEFAULTS_CACHE is None:
+        _DEFAULTS_CACHE = tuple(sd.default.device)
+    return _DEFAULTS_CACHE
+
 def print_separator(title=""):
     """打印分隔线"""
     if title:
@@ -22,22 +66,19 @@ def list_all_devices():
     print_separator("所有音频设备")
     
     try:
-        devices = sd.query_devices()
-        
-        print(f"{'ID':<4} {'名称':<30} {'类型':<8} {'声道':<8} {'采样率'}")
-        print("-" * 60)
+        devices = _get_devices()
         
+        rows = [HDR_ALL, RULE_ALL]
         for i, device in enumerate(devices):
-            device_type = ""
-            if device['max_input_channels'] > 0:
-                device_type += "输入 "
-            if device['max_output_channels'] > 0:
-                device_type += "输出"
+            device_type = _TYPE_LABEL[(device['max_input_channels'] > 0, device['max_output_channels'] > 0)]
             
             channels = f"{device['max_input_channels']}/{device['max_output_channels']}"
             sample_rate = int(device['default_samplerate'])
             
-            print(f"{i:<4} {device['name'][:30]:<30} {device_type:<8} {channels:<8} {sample_rate}")
+            rows.append(f"{i:<4} {device['name'][:30]:<30} {device_type:<8} {channels:<8} {sample_rate}")
+        
+        # 整张表一次性写出
+        sys.stdout.write('\n'.join(rows) + '\n')
             
     except Exception as e:
         print(f"❌ 设备列举失败: {e}")
@@ -50,30 +91,29 @@ def list_input_devices():
     print_separator("可用输入设备 (麦克风)")
     
     try:
-        devices = sd.query_devices()
-        input_devices = []
+        devices = _get_devices()
+        input_devices = [(i, device) for i, device in enumerate(devices) if device['max_input_channels'] > 0]
         
         # 获取默认输入设备ID
-        default_input_id = sd.default.device[0]
+        default_input_id = _get_defaults()[0]
         
-        print(f"{'ID':<4} {'名称':<60} {'声道数':<8} {'采样率'}")
-        print("-" * 80)
+        rows = [HDR_IO, RULE_IO]
+        for i, device in input_devices:
+            sample_rate = int(device['default_samplerate'])
+            
+            # 标识默认设备
+            default_mark = " [默认]" if i == default_input_id else ""
+            device_name = device['name'] + default_mark
+            
+            # 显示完整设备名称，不截断
+            if len(device_name) > 60:
+                rows.append(f"{i:<4} {device_name}")
+                rows.append(f"{'':>4} {'':>60} {device['max_input_channels']:<8} {sample_rate}")
+            else:
+                rows.append(f"{i:<4} {device_name:<60} {device['max_input_channels']:<8} {sample_rate}")
         
-        for i, device in enumerate(devices):
-            if device['max_input_channels'] > 0:
-                input_devices.append((i, device))
-                sample_rate = int(device['default_samplerate'])
-                
-                # 标识默认设备
-                default_mark = " [默认]" if i == default_input_id else ""
-                device_name = device['name'] + default_mark
-                
-                # 显示完整设备名称，不截断
-                if len(device_name) > 60:
-                    print(f"{i:<4} {device_name}")
-                    print(f"{'':>4} {'':>60} {device['max_input_channels']:<8} {sample_rate}")
-                else:
-                    print(f"{i:<4} {device_name:<60} {device['max_input_channels']:<8} {sample_rate}")
+        # 整张表一次性写出
+        sys.stdout.write('\n'.join(rows) + '\n')
         
         return input_devices
         
@@ -86,30 +126,29 @@ def list_output_devices():
     print_separator("可用输出设备 (扬声器)")
     
     try:
-        devices = sd.query_devices()
-        output_devices = []
+        devices = _get_devices()
+        output_devices = [(i, device) for i, device in enumerate(devices) if device['max_output_channels'] > 0]
         
         # 获取默认输出设备ID
-        default_output_id = sd.default.device[1]
+        default_output_id = _get_defaults()[1]
         
-        print(f"{'ID':<4} {'名称':<60} {'声道数':<8} {'采样率'}")
-        print("-" * 80)
+        rows = [HDR_IO, RULE_IO]
+        for i, device in output_devices:
+            sample_rate = int(device['default_samplerate'])
+            
+            # 标识默认设备
+            default_mark = " [默认]" if i == default_output_id else ""
+            device_name = device['name'] + default_mark
+            
+            # 显示完整设备名称，不截断
+            if len(device_name) > 60:
+                rows.append(f"{i:<4} {device_name}")
+                rows.append(f"{'':>4} {'':>60} {device['max_output_channels']:<8} {sample_rate}")
+            else:
+                rows.append(f"{i:<4} {device_name:<60} {device['max_output_channels']:<8} {sample_rate}")
         
-        for i, device in enumerate(devices):
-            if device['max_output_channels'] > 0:
-                output_devices.append((i, device))
-                sample_rate = int(device['default_samplerate'])
-                
-                # 标识默认设备
-                default_mark = " [默认]" if i == default_output_id else ""
-                device_name = device['name'] + default_mark
-                
-                # 显示完整设备名称，不截断
-                if len(device_name) > 60:
-                    print(f"{i:<4} {device_name}")
-                    print(f"{'':>4} {'':>60} {device['max_output_channels']:<8} {sample_rate}")
-                else:
-                    print(f"{i:<4} {device_name:<60} {device['max_output_channels']:<8} {sample_rate}")
+        # 整张表一次性写出
+        sys.stdout.write('\n'.join(rows) + '\n')
         
         return output_devices
         
@@ -119,28 +158,74 @@ def list_output_devices():
 
 def test_recording(device_id, duration=3):
     """测试录音功能"""
+    import sounddevice as sd
+    import numpy as np
+    
     print(f"\n🎤 测试设备 {device_id} 录音功能...")
     print(f"📝 将录制 {duration} 秒音频，请对着麦克风说话...")
     
     try:
         # 开始录音
         print("🔴 开始录音...")
-        audio_data = sd.rec(
-            int(16000 * duration), 
-            samplerate=16000, 
-            channels=2, 
+        total_frames = int(16000 * duration)
+        audio_data = np.empty((total_frames, 2), dtype=np.float32)  # 预分配录音缓冲区
+        filled = 0
+        done = threading.Event()
+        
+        # 分析线程在录音过程中逐块累计幅度，录音结束时结果即已就绪
+        block_queue = queue.Queue()
+        max_amplitude = 0.0
+        sq_sum = 0.0
+        
+        def analyzer():
+            nonlocal max_amplitude, sq_sum
+            while True:
+                span = block_queue.get()
+                if span is None:
+                    break
+                block = audio_data[span[0]:span[1]]
+                max_amplitude = max(max_amplitude, float(block.max()), -float(block.min()))
+                # 平方和直接归约，不生成block**2中间数组
+                sq_sum += float(np.einsum('ij,ij->', block, block))
+        
+        analyzer_thread = threading.Thread(target=analyzer, daemon=True)
+        analyzer_thread.start()
+        
+        def callback(indata, frames, time_info, status):
+            nonlocal filled
+            n = min(frames, total_frames - filled)
+            audio_data[filled:filled + n] = indata[:n]
+            block_queue.put_nowait((filled, filled + n))
+            filled += n
+            if filled >= total_frames:
+                done.set()
+                raise sd.CallbackStop
+        
+        with sd.InputStream(
+            samplerate=16000,
+            channels=2,
             device=device_id,
-            dtype=np.float32
-        )
-        sd.wait()  # 等待录音完成
+            dtype=np.float32,
+            blocksize=1024,
+            latency='low',
+            callback=callback
+        ) as stream:
+            latency = stream.latency
+            done.wait(timeout=duration + 2)  # 等待录音完成
         
-        # 分析音频
-        max_amplitude = np.max(np.abs(audio_data))
-        rms_amplitude = np.sqrt(np.mean(audio_data**2))
+        # 等待分析线程处理完剩余的块
+        block_queue.put(None)
+        analyzer_thread.join()
+        if filled == 0:
+            print("❌ 录音测试失败: 未接收到音频数据")
+            return False
+        
+        rms_amplitude = (sq_sum / (filled * 2)) ** 0.5
         
         print(f"✅ 录音完成")
         print(f"📊 最大幅度: {max_amplitude:.4f}")
         print(f"📊 RMS幅度: {rms_amplitude:.4f}")
+        print(f"📊 输入延迟: {latency * 1000:.1f} ms")
         
         if max_amplitude > 0.001:
             print("🎉 设备工作正常，检测到音频信号")
@@ -158,6 +243,9 @@ def test_recording(device_id, duration=3):
 
 def test_playback(device_id):
     """测试播放功能"""
+    import sounddevice as sd
+    import numpy as np
+    
     print(f"\n🔊 测试设备 {device_id} 播放功能...")
     
     try:
@@ -166,11 +254,17 @@ def test_playback(device_id):
         sample_rate = 16000
         frequency = 1000  # Hz
         
-        t = np.linspace(0, duration, int(sample_rate * duration), False)
-        audio_data = 0.3 * np.sin(2 * np.pi * frequency * t)
-        
-        # 转换为立体声
-        stereo_audio = np.column_stack((audio_data, audio_data))
+        global _TEST_TONE
+        if _TEST_TONE is None:
+            # 直接生成float32数据，播放时无需再做类型转换
+            n = int(sample_rate * duration)
+            t = np.arange(n, dtype=np.float32) * np.float32(2 * np.pi * frequency / sample_rate)
+            audio_data = np.sin(t, dtype=np.float32)
+            audio_data *= np.float32(0.3)
+            
+            # 转换为连续存储的立体声
+            _TEST_TONE = np.broadcast_to(audio_data[:, np.newaxis], (n, 2)).copy()
+        stereo_audio = _TEST_TONE
         
         print("🔊 播放测试音频 (1kHz正弦波)...")
         sd.play(stereo_audio, samplerate=sample_rate, device=device_id)
@@ -188,17 +282,13 @@ def find_device_by_name(keyword):
     print(f"\n🔍 查找包含 '{keyword}' 的设备...")
     
     try:
-        devices = sd.query_devices()
+        devices = _get_devices()
         found_devices = []
         
         for i, device in enumerate(devices):
             if keyword.lower() in device['name'].lower():
                 found_devices.append((i, device))
-                device_type = ""
-                if device['max_input_channels'] > 0:
-                    device_type += "输入 "
-                if device['max_output_channels'] > 0:
-                    device_type += "输出"
+                device_type = _TYPE_LABEL[(device['max_input_channels'] > 0, device['max_output_channels'] > 0)]
                 
                 print(f"✅ 找到设备 {i}: {device['name']} ({device_type})")
         
@@ -216,7 +306,7 @@ def generate_config_suggestions(input_device_id, output_device_id):
     print_separator("配置建议")
     
     try:
-        devices = sd.query_devices()
+        devices = _get_devices()
         input_device = devices[input_device_id]
         output_device = devices[output_device_id]
         
@@ -347,9 +437,9 @@ def show_default_devices():
     print_separator("系统默认设备")
     
     try:
-        devices = sd.query_devices()
-        default_input_id = sd.default.device[0]
-        default_output_id = sd.default.device[1]
+        devices = _get_devices()
+        default_input_id = _get_defaults()[0]
+        default_output_id = _get_defaults()[1]
         
         print("📥 默认输入设备 (录音):")
         if 0 <= default_input_id < len(devices):
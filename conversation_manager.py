@@ -4,10 +4,43 @@
 管理录制文件和TTS文件的一一对应关系
 """
 
+import atexit
+import heapq
 import json
+import os
+import pickle
+import threading
 import time
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Union
+
+try:
+    import orjson  # 可选：更快的JSON编解码
+except ImportError:
+    orjson = None
+
+def _json_dumps(obj, indent: bool = False) -> str:
+    """序列化为JSON字符串（优先使用orjson）"""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0).decode('utf-8')
+    if indent:
+        return json.dumps(obj, ensure_ascii=False, indent=2)
+    # 紧凑输出并转义非ASCII字符，走标准库编码器的快速路径
+    return json.dumps(obj, separators=(',', ':'))
+
+def _json_loads(data):
+    """解析JSON字符串或字节（优先使用orjson）"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def _as_file_list(tts_file) -> List[str]:
+    """TTS文件字段统一为路径列表（兼容旧记录中的单个路径）"""
+    if not tts_file:
+        return []
+    if isinstance(tts_file, str):
+        return [tts_file]
+    return list(tts_file)
 
 class ConversationManager:
     """对话记录管理器 - 管理完整的对话链路"""
@@ -26,12 +59,41 @@ class ConversationManager:
         self.conversation_dir.mkdir(exist_ok=True)
         self.max_conversations = max_conversations
         
-        # 对话记录索引文件
+        # 对话记录索引文件（快照）和增量事件日志
         self.index_file = self.conversation_dir / "conversation_index.json"
+        self.events_file = self.conversation_dir / "conversation_events.jsonl"
+        self.index_cache_file = self.conversation_dir / "conversation_index.pkl"  # 索引的二进制缓存，JSON仍为准
+        self._next_id = None  # 快照中记录的下一个对话ID
         self.conversation_index = self._load_index()
+        self._event_count = self._replay_events()
+        
+        # 当前对话ID计数器（快照缺少时才扫描索引推算）
+        if self._next_id is not None:
+            self.conversation_counter = self._next_id
+        else:
+            self.conversation_counter = self._get_next_conversation_id()
         
-        # 当前对话ID计数器
-        self.conversation_counter = self._get_next_conversation_id()
+        # 启动时将回放后的索引写成快照，事件日志从空开始
+        self._events_log = open(self.events_file, 'a', encoding='utf-8')
+        if self._event_count:
+            self._save_index()
+        
+        # 事件写入后延迟合并刷盘，退出时保证写入
+        self._io_lock = threading.Lock()
+        self._dirty = False
+        self._flush_timer = None
+        atexit.register(self._flush)
+        
+        # 统计累计值，随记录增删增量维护
+        self._total_user_chars = 0
+        self._total_ai_chars = 0
+        self._complete_count = 0
+        for conv in self.conversation_index.values():
+            self._update_stats(conv, 1)
+        
+        # 预先小写化的搜索文本（仅在内存中，不写入索引）
+        self._search_blobs = {conv_id: self._make_search_blob(conv)
+                              for conv_id, conv in self.conversation_index.items()}
         
         print(f"💬 对话记录管理器初始化完成")
         print(f"📁 对话记录目录: {self.conversation_dir.absolute()}")
@@ -41,17 +103,148 @@ class ConversationManager:
         """加载对话索引"""
         try:
             if self.index_file.exists():
-                with open(self.index_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
+                data = self._load_index_cache()
+                if data is None:
+                    data = _json_loads(self.index_file.read_bytes())
+                    self._save_index_cache(data)
+                if '_meta' not in data:
+                    return data  # 旧版格式：整个文件即为对话索引
+                next_id = data['_meta'].get('next_id')
+                self._next_id = next_id if isinstance(next_id, int) else None
+                return data.get('conversations', {})
         except Exception as e:
             print(f"⚠️ 加载对话索引失败: {e}")
         return {}
     
+    def _load_index_cache(self) -> Optional[Dict]:
+        """读取索引的pickle缓存（不比JSON旧时才使用）"""
+        try:
+            if (self.index_cache_file.exists() and
+                    self.index_cache_file.stat().st_mtime >= self.index_file.stat().st_mtime):
+                return pickle.loads(self.index_cache_file.read_bytes())
+        except Exception:
+            pass  # 缓存损坏时回退到解析JSON
+        return None
+    
+    def _save_index_cache(self, data: Dict):
+        """写入索引的pickle缓存"""
+        try:
+            tmp_file = self.index_cache_file.with_suffix('.pkl.tmp')
+            tmp_file.write_bytes(pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL))
+            os.replace(tmp_file, self.index_cache_file)
+        except Exception as e:
+            print(f"⚠️ 保存对话索引缓存失败: {e}")
+    
+    def _replay_events(self) -> int:
+        """在索引快照上回放事件日志，返回回放的事件数"""
+        count = 0
+        try:
+            if self.events_file.exists():
+                with open(self.events_file, 'r', encoding='utf-8') as f:
+                    for line in f:
+                        try:
+                            event = _json_loads(line)
+                        except ValueError:
+                            continue  # 跳过写入中断的残缺行
+                        self._apply_event(event)
+                        count += 1
+        except Exception as e:
+            print(f"⚠️ 回放对话事件日志失败: {e}")
+        return count
+    
+    def _apply_event(self, event: Dict):
+        """将单条事件应用到内存索引（重复应用结果不变）"""
+        op = event.get('op')
+        if op == 'create':
+            record = event['record']
+            self.conversation_index[record['conversation_id']] = record
+            if self._next_id is not None:
+                try:
+                    id_num = int(record['conversation_id'].split('_')[1])
+                    self._next_id = max(self._next_id, id_num + 1)
+                except (IndexError, ValueError):
+                    pass
+        elif op == 'update':
+            conv = self.conversation_index.get(event['conversation_id'])
+            if conv is not None:
+                conv['tts_file'] = event['tts_file']
+                conv['complete'] = True
+        elif op == 'delete':
+            self.conversation_index.pop(event['conversation_id'], None)
+    
+    def _update_stats(self, conv: Dict, sign: int):
+        """将一条记录计入(sign=1)或移出(sign=-1)统计累计值"""
+        self._total_user_chars += sign * len(conv.get('user_text', '') or '')
+        self._total_ai_chars += sign * len(conv.get('ai_response', '') or '')
+        if conv.get('complete', False):
+            self._complete_count += sign
+    
+    @staticmethod
+    def _format_time(conv: Dict) -> str:
+        """格式化对话创建时间（旧记录直接使用已保存的formatted_time）"""
+        if 'formatted_time' in conv:
+            return conv['formatted_time']
+        if 'created' in conv:
+            return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(conv['created']))
+        return '未知'
+    
+    @staticmethod
+    def _make_search_blob(conv: Dict) -> str:
+        """拼接用户文本和AI回复并转为小写，用于文本搜索"""
+        return f"{conv.get('user_text', '') or ''}\x1f{conv.get('ai_response', '') or ''}".lower()
+    
+    def _append_event(self, event: Dict):
+        """追加一条事件到日志，只写入本次修改"""
+        with self._io_lock:
+            try:
+                self._events_log.write(_json_dumps(event) + '\n')
+                self._event_count += 1
+            except Exception as e:
+                print(f"⚠️ 写入对话事件日志失败: {e}")
+                return
+            self._mark_dirty()
+    
+    def _mark_dirty(self):
+        """标记有未刷盘的事件，并安排一次延迟刷盘"""
+        self._dirty = True
+        if self._flush_timer is None:
+            self._flush_timer = threading.Timer(0.2, self._flush)
+            self._flush_timer.daemon = True
+            self._flush_timer.start()
+    
+    def _flush(self):
+        """将缓冲的事件写入磁盘，日志过长时压缩为快照"""
+        with self._io_lock:
+            self._flush_timer = None
+            if not self._dirty:
+                return
+            self._dirty = False
+            try:
+                self._events_log.flush()
+            except Exception as e:
+                print(f"⚠️ 写入对话事件日志失败: {e}")
+                return
+            
+            # 日志过长时压缩为快照
+            if self._event_count > self.max_conversations * 2:
+                self._save_index()
+    
     def _save_index(self):
-        """保存对话索引"""
+        """保存对话索引快照并清空事件日志"""
         try:
-            with open(self.index_file, 'w', encoding='utf-8') as f:
-                json.dump(self.conversation_index, f, ensure_ascii=False, indent=2)
+            tmp_file = self.index_file.with_suffix('.json.tmp')
+            snapshot = {
+                '_meta': {'next_id': self.conversation_counter},
+                'conversations': self.conversation_index
+            }
+            tmp_file.write_text(_json_dumps(snapshot), encoding='utf-8')
+            os.replace(tmp_file, self.index_file)
+            self._save_index_cache(snapshot)
+            
+            # 快照已包含全部事件，截断日志
+            self._events_log.seek(0)
+            self._events_log.truncate()
+            self._event_count = 0
         except Exception as e:
             print(f"⚠️ 保存对话索引失败: {e}")
     
@@ -76,32 +269,33 @@ class ConversationManager:
         if len(self.conversation_index) <= self.max_conversations:
             return
         
-        # 按创建时间排序，删除最旧的对话
-        sorted_conversations = sorted(
+        # 只选出需要删除的最旧对话，无需对全部记录排序
+        conversations_to_remove = len(self.conversation_index) - self.max_conversations
+        oldest_conversations = heapq.nsmallest(
+            conversations_to_remove,
             self.conversation_index.items(),
             key=lambda x: x[1].get('created', 0)
         )
         
-        conversations_to_remove = len(self.conversation_index) - self.max_conversations
-        for i in range(conversations_to_remove):
-            conv_id, conv_info = sorted_conversations[i]
-            
+        for conv_id, conv_info in oldest_conversations:
             try:
                 # 删除对话记录（但保留音频文件，因为它们有自己的缓存管理）
                 del self.conversation_index[conv_id]
+                self._update_stats(conv_info, -1)
+                self._search_blobs.pop(conv_id, None)
+                self._append_event({'op': 'delete', 'conversation_id': conv_id})
                 # 静默删除对话记录
             except Exception as e:
                 # 静默处理删除失败
                 pass
         
-        self._save_index()
         # 静默完成清理
     
     def create_conversation_record(self, 
                                  user_text: str, 
                                  ai_response: str,
                                  recording_file: str = None,
-                                 tts_file: str = None) -> str:
+                                 tts_file: Union[str, List[str]] = None) -> str:
         """
         创建对话记录
         
@@ -109,19 +303,20 @@ class ConversationManager:
             user_text: 用户语音识别文本
             ai_response: AI回复文本
             recording_file: 录制文件路径
-            tts_file: TTS文件路径
+            tts_file: TTS文件路径（分句播报时为各句音频路径列表）
             
         Returns:
             对话ID
         """
         conversation_id = f"conv_{self.conversation_counter}"
+        # 递增计数器（在写入事件之前，保证快照中的next_id不会重复）
+        self.conversation_counter += 1
         timestamp = time.time()
         
         # 创建对话记录
         conversation_record = {
             'conversation_id': conversation_id,
-            'created': timestamp,
-            'formatted_time': time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(timestamp)),
+            'created': timestamp,  # 可读时间在导出时再格式化
             'user_text': user_text,
             'ai_response': ai_response,
             'recording_file': recording_file,
@@ -131,33 +326,36 @@ class ConversationManager:
         
         # 保存到索引
         self.conversation_index[conversation_id] = conversation_record
+        self._update_stats(conversation_record, 1)
+        self._search_blobs[conversation_id] = self._make_search_blob(conversation_record)
+        self._append_event({'op': 'create', 'record': conversation_record})
         
         # 清理旧记录
         self._cleanup_old_conversations()
-        self._save_index()
-        
-        # 递增计数器
-        self.conversation_counter += 1
         
         print(f"📝 创建对话记录 ({conversation_id})")
         return conversation_id
     
-    def update_conversation_tts(self, conversation_id: str, tts_file: str):
+    def update_conversation_tts(self, conversation_id: str, tts_file: Union[str, List[str]]):
         """更新对话记录的TTS文件"""
         if conversation_id in self.conversation_index:
+            if not self.conversation_index[conversation_id].get('complete', False):
+                self._complete_count += 1
             self.conversation_index[conversation_id]['tts_file'] = tts_file
             self.conversation_index[conversation_id]['complete'] = True
-            self._save_index()
-            print(f" -> {Path(tts_file).name}")
+            self._append_event({'op': 'update', 'conversation_id': conversation_id, 'tts_file': tts_file})
+            print(f" -> {', '.join(Path(f).name for f in _as_file_list(tts_file))}")
         else:
             print(f"⚠️ 对话记录不存在: {conversation_id}")
     
-    def update_conversation_tts_silent(self, conversation_id: str, tts_file: str):
+    def update_conversation_tts_silent(self, conversation_id: str, tts_file: Union[str, List[str]]):
         """静默更新对话记录的TTS文件（不打印日志）"""
         if conversation_id in self.conversation_index:
+            if not self.conversation_index[conversation_id].get('complete', False):
+                self._complete_count += 1
             self.conversation_index[conversation_id]['tts_file'] = tts_file
             self.conversation_index[conversation_id]['complete'] = True
-            self._save_index()
+            self._append_event({'op': 'update', 'conversation_id': conversation_id, 'tts_file': tts_file})
         # 不存在时也保持静默
     
     def get_conversation_record(self, conversation_id: str) -> Optional[Dict]:
@@ -166,15 +364,10 @@ class ConversationManager:
     
     def find_conversations_by_text(self, search_text: str) -> List[Dict]:
         """根据文本搜索对话记录"""
-        results = []
         search_text_lower = search_text.lower()
-        
-        for conv_id, conv_info in self.conversation_index.items():
-            user_text = conv_info.get('user_text', '').lower()
-            ai_response = conv_info.get('ai_response', '').lower()
-            
-            if search_text_lower in user_text or search_text_lower in ai_response:
-                results.append(conv_info)
+        results = [self.conversation_index[conv_id]
+                   for conv_id, blob in self._search_blobs.items()
+                   if search_text_lower in blob]
         
         # 按时间排序（最新的在前）
         results.sort(key=lambda x: x.get('created', 0), reverse=True)
@@ -182,22 +375,18 @@ class ConversationManager:
     
     def get_recent_conversations(self, limit: int = 10) -> List[Dict]:
         """获取最近的对话记录"""
-        conversations = list(self.conversation_index.values())
-        conversations.sort(key=lambda x: x.get('created', 0), reverse=True)
-        return conversations[:limit]
+        # 只取最新的limit条，无需对全部记录排序
+        return heapq.nlargest(limit, self.conversation_index.values(),
+                              key=lambda x: x.get('created', 0))
     
     def get_conversation_stats(self) -> Dict:
         """获取对话统计信息"""
         total_conversations = len(self.conversation_index)
-        complete_conversations = sum(1 for conv in self.conversation_index.values() 
-                                   if conv.get('complete', False))
-        
-        # 计算平均对话长度
-        user_texts = [conv.get('user_text', '') for conv in self.conversation_index.values()]
-        ai_responses = [conv.get('ai_response', '') for conv in self.conversation_index.values()]
+        complete_conversations = self._complete_count
         
-        avg_user_length = sum(len(text) for text in user_texts) / len(user_texts) if user_texts else 0
-        avg_ai_length = sum(len(text) for text in ai_responses) / len(ai_responses) if ai_responses else 0
+        # 计算平均对话长度（使用增量维护的累计值）
+        avg_user_length = self._total_user_chars / total_conversations if total_conversations else 0
+        avg_ai_length = self._total_ai_chars / total_conversations if total_conversations else 0
         
         return {
             'total_conversations': total_conversations,
@@ -207,14 +396,25 @@ class ConversationManager:
             'avg_ai_response_length': round(avg_ai_length, 1)
         }
     
+    def format_txt_record(self, conv: Dict, include_tts: bool = True) -> str:
+        """格式化单条对话为文本导出格式（include_tts为False时省略TTS文件行）"""
+        tts_line = f"TTS文件: {', '.join(_as_file_list(conv.get('tts_file'))) or '无'}\n" if include_tts else ""
+        return (
+            f"时间: {self._format_time(conv)}\n"
+            f"用户: {conv.get('user_text', '未识别')}\n"
+            f"AI: {conv.get('ai_response', '无回复')}\n"
+            f"录制文件: {conv.get('recording_file', '无')}\n"
+            + tts_line
+            + "-" * 30 + "\n\n"
+        )
+    
     def export_conversations(self, format: str = 'json') -> str:
         """导出对话记录"""
         timestamp = time.strftime("%Y%m%d_%H%M%S")
         
         if format == 'json':
             export_file = self.conversation_dir / f"export_{timestamp}.json"
-            with open(export_file, 'w', encoding='utf-8') as f:
-                json.dump(self.conversation_index, f, ensure_ascii=False, indent=2)
+            export_file.write_text(_json_dumps(self.conversation_index, indent=True), encoding='utf-8')
         
         elif format == 'txt':
             export_file = self.conversation_dir / f"export_{timestamp}.txt"
@@ -229,12 +429,7 @@ class ConversationManager:
                 )
                 
                 for conv in conversations:
-                    f.write(f"时间: {conv.get('formatted_time', '未知')}\n")
-                    f.write(f"用户: {conv.get('user_text', '未识别')}\n")
-                    f.write(f"AI: {conv.get('ai_response', '无回复')}\n")
-                    f.write(f"录制文件: {conv.get('recording_file', '无')}\n")
-                    f.write(f"TTS文件: {conv.get('tts_file', '无')}\n")
-                    f.write("-" * 30 + "\n\n")
+                    f.write(self.format_txt_record(conv))
         
         print(f"📤 对话记录已导出: {export_file}")
         return str(export_file)
@@ -248,12 +443,26 @@ class ConversationManager:
             'complete_conversations': 0
         }
         
+        # 每个目录只扫描一次，之后按文件名查表，避免逐个stat
+        dir_listings = {}
+        
+        def file_exists(file_path):
+            path = Path(file_path)
+            parent = str(path.parent)
+            if parent not in dir_listings:
+                try:
+                    with os.scandir(parent) as entries:
+                        dir_listings[parent] = {entry.name for entry in entries if entry.is_file()}
+                except OSError:
+                    dir_listings[parent] = set()
+            return path.name in dir_listings[parent]
+        
         for conv_info in self.conversation_index.values():
             recording_file = conv_info.get('recording_file')
             tts_file = conv_info.get('tts_file')
             
-            recording_exists = recording_file and Path(recording_file).exists()
-            tts_exists = tts_file and Path(tts_file).exists()
+            recording_exists = recording_file and file_exists(recording_file)
+            tts_exists = tts_file and all(file_exists(f) for f in _as_file_list(tts_file))
             
             if not recording_exists and recording_file:
                 results['missing_recording_files'] += 1
@@ -5,7 +5,12 @@ DeepSeek 聊天模块
 """
 
 import os   
+import re
+import sqlite3
+import threading
+import time
 import uuid
+from collections import OrderedDict, deque
 from typing import Dict, Any, List, Optional
 from datetime import datetime
 import json
@@ -14,15 +19,32 @@ from langchain_deepseek import ChatDeepSeek
 from langgraph.graph import StateGraph, START, END, MessagesState
 from langgraph.checkpoint.memory import MemorySaver
 
+try:
+    import orjson  # 可选：更快的JSON编码
+except ImportError:
+    orjson = None
+
+try:
+    from langgraph.checkpoint.sqlite import SqliteSaver  # 可选：对话状态持久化到本地SQLite
+except ImportError:
+    SqliteSaver = None
+
 class DeepSeekChatModule:
     """DeepSeek 聊天模块 - 专为语音系统设计"""
     
+    # AI回复失败时返回给用户的提示
+    ERROR_MESSAGE = "抱歉，我现在遇到了一些问题，请稍后再试。"
+    
     def __init__(self, 
                  api_key: str = None,
                  model_name: str = "deepseek-chat",
                  system_prompt: str = None,
                  max_history_length: int = 20,
-                 auto_summarize_threshold: int = 50):
+                 max_history_tokens: int = 8000,
+                 auto_summarize_threshold: int = 50,
+                 response_cache_size: int = 0,
+                 response_cache_ttl: float = 300.0,
+                 checkpoint_db: str = None):
         """
         初始化 DeepSeek 聊天模块
         
@@ -31,7 +53,11 @@ class DeepSeekChatModule:
             model_name: 模型名称
             system_prompt: 系统提示词
             max_history_length: 最大保留的对话轮数
+            max_history_tokens: 发送给模型的历史消息的估算token上限
             auto_summarize_threshold: 自动总结触发的对话轮数
+            response_cache_size: 相同问题回复缓存的条目数（0表示不启用）
+            response_cache_ttl: 回复缓存有效期（秒）
+            checkpoint_db: 对话状态SQLite数据库路径（为空时仅保存在内存中）
         """
         # 从环境变量获取API密钥，如果没有传入的话
         self.api_key = api_key or os.getenv('DEEPSEEK_API_KEY')
@@ -39,10 +65,27 @@ class DeepSeekChatModule:
         if not self.api_key:
             raise ValueError("❌ DeepSeek API密钥未设置！请设置环境变量 DEEPSEEK_API_KEY 或传入 api_key 参数")
         self.model_name = model_name
+        self.checkpoint_db = checkpoint_db
         self.max_history_length = max_history_length
+        self.max_history_tokens = max_history_tokens
         self.auto_summarize_threshold = auto_summarize_threshold
         self.conversation_count = 0
         self.conversation_summary = ""
+        self.summary_keep_messages = 4  # 整理历史时原样保留的最近消息数，其余并入摘要
+        
+        # 发送给模型的对话窗口 [(消息, 估算token数)]，按线程增量维护
+        self._dialog = deque()
+        self._dialog_tokens = 0  # 窗口内消息的估算token总数
+        self._dialog_thread = None  # 窗口对应的线程ID
+        self._dialog_seen = 0  # 已并入窗口的状态消息数
+        
+        # 对话记录镜像：每轮追加，查询历史时无需反序列化检查点
+        self._history_mirror = deque(maxlen=max_history_length * 2)
+        
+        # 回复缓存：规范化后的用户文本相同且摘要未变化时直接复用回复，省去API调用
+        self.response_cache_size = response_cache_size
+        self.response_cache_ttl = response_cache_ttl
+        self._response_cache = OrderedDict()  # (规范化文本, 摘要) -> (时间, 回复)
         
         # 语音助手专用提示词
         self.system_prompt = system_prompt or """你是一个智能语音助手小云，具有以下特点：
@@ -69,8 +112,13 @@ class DeepSeekChatModule:
         self._init_model()
         self._init_graph()
         
-        # 对话线程ID
-        self.thread_id = uuid.uuid4().hex
+        # 对话线程ID（持久化时恢复上次的线程和摘要）
+        # 线程配置只在切换线程时重建，每轮对话直接复用
+        self._set_thread(uuid.uuid4().hex)
+        self._load_chat_meta()
+        self._history_mirror.extend(self._read_thread_history())
+        # 同一对话线程的请求依次处理（每轮依赖上一轮回复，不能并发）
+        self._chat_lock = threading.Lock()
         
         print("✅ DeepSeek 语音聊天模块初始化完成")
         print(f"💭 对话管理: 最大保留 {max_history_length} 轮，每 {auto_summarize_threshold} 轮自动整理")
@@ -95,25 +143,83 @@ class DeepSeekChatModule:
             
             # 如果没有系统消息，添加一个
             if not messages or not isinstance(messages[0], SystemMessage):
-                system_content = self.system_prompt
-                # 如果有对话摘要，添加到系统提示中
+                # 固定的系统提示词始终放在最前且保持不变，便于服务端复用前缀缓存；
+                # 会变化的对话摘要放在其后单独的系统消息中
+                prefix = [self._system_message]
                 if self.conversation_summary:
-                    system_content += f"\n\n[对话历史摘要: {self.conversation_summary}]"
-                messages = [SystemMessage(content=system_content)] + messages
+                    prefix.append(SystemMessage(content=f"[对话历史摘要: {self.conversation_summary}]"))
+                messages = prefix + messages
             
             response = self.model.invoke(messages)
             return {'messages': [response]}
         
+        self._system_message = SystemMessage(content=self.system_prompt)
+        
         # 构建状态图
         graph_builder = StateGraph(state_schema=MessagesState)
         graph_builder.add_node('chatbot', chatbot_node)
         graph_builder.add_edge(START, 'chatbot')
         graph_builder.add_edge('chatbot', END)
         
-        # 编译图（使用内存保存器实现状态持久化）
-        self.graph = graph_builder.compile(checkpointer=MemorySaver())
+        # 编译图（配置了数据库时持久化到SQLite，否则使用内存保存器）
+        self.checkpointer = self._create_checkpointer()
+        self.graph = graph_builder.compile(checkpointer=self.checkpointer)
         print("✅ LangGraph 状态图构建完成")
     
+    def _create_checkpointer(self):
+        """创建检查点保存器"""
+        if self.checkpoint_db:
+            if SqliteSaver is None:
+                print("⚠️ 未安装 langgraph-checkpoint-sqlite，对话状态仅保存在内存中")
+            else:
+                try:
+                    conn = sqlite3.connect(self.checkpoint_db, check_same_thread=False)
+                    print(f"✅ 对话状态持久化: {self.checkpoint_db}")
+                    return SqliteSaver(conn)
+                except Exception as e:
+                    print(f"⚠️ 打开对话状态数据库失败，改用内存保存: {e}")
+        return MemorySaver()
+    
+    @property
+    def _chat_meta_file(self):
+        """线程ID和摘要的元数据文件（仅持久化模式）"""
+        if self.checkpoint_db and not isinstance(self.checkpointer, MemorySaver):
+            return self.checkpoint_db + '.meta.json'
+        return None
+    
+    def _load_chat_meta(self):
+        """恢复上次的对话线程ID、摘要和轮数"""
+        meta_file = self._chat_meta_file
+        if not meta_file or not os.path.exists(meta_file):
+            return
+        try:
+            with open(meta_file, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            self._set_thread(meta.get('thread_id') or self.thread_id)
+            self.conversation_summary = meta.get('summary', '')
+            self.conversation_count = meta.get('conversation_count', 0)
+            print(f"♻️ 已恢复上次对话 ({self.conversation_count} 轮)")
+        except Exception as e:
+            print(f"⚠️ 恢复对话状态失败: {e}")
+    
+    def _save_chat_meta(self):
+        """保存当前对话线程ID、摘要和轮数"""
+        meta_file = self._chat_meta_file
+        if not meta_file:
+            return
+        try:
+            meta = {
+                'thread_id': self.thread_id,
+                'summary': self.conversation_summary,
+                'conversation_count': self.conversation_count
+            }
+            tmp_file = meta_file + '.tmp'
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump(meta, f, ensure_ascii=False)
+            os.replace(tmp_file, meta_file)
+        except Exception as e:
+            print(f"⚠️ 保存对话状态失败: {e}")
+    
     def get_ai_response(self, user_text: str) -> str:
         """
         获取AI回复（专为语音系统优化，带智能历史管理）
@@ -124,9 +230,26 @@ class DeepSeekChatModule:
         Returns:
             AI回复文本
         """
-        try:
-            config = {"configurable": {"thread_id": self.thread_id}}
+        with self._chat_lock:
+            return ''.join(self._iter_ai_response(user_text, stream=False))
+    
+    def get_ai_response_stream(self, user_text: str):
+        """
+        流式获取AI回复，边生成边逐段产出文本
+        
+        Args:
+            user_text: 用户语音识别的文本
             
+        Yields:
+            AI回复的文本片段
+        """
+        with self._chat_lock:
+            yield from self._iter_ai_response(user_text, stream=True)
+    
+    def _iter_ai_response(self, user_text: str, stream: bool):
+        """生成AI回复的文本片段（调用方需持有_chat_lock）"""
+        produced = False
+        try:
             # 增加对话计数
             self.conversation_count += 1
             
@@ -135,59 +258,160 @@ class DeepSeekChatModule:
                 print("🔄 对话记录较多，正在智能整理...")
                 self._auto_summarize_history()
             
-            # 调用AI获取回复
-            result = self.graph.invoke(
-                {'messages': [HumanMessage(content=user_text)]},
-                config
-            )
+            # 摘要整理可能切换线程，需在其后再取配置
+            config = self._config
             
-            ai_response = result['messages'][-1].content
+            cache_key = self._response_cache_key(user_text)
+            ai_response = self._get_cached_response(cache_key)
+            if ai_response is not None:
+                # 命中缓存：仅把本轮对话写入历史，不调用API
+                self.graph.update_state(
+                    config,
+                    {'messages': [HumanMessage(content=user_text), AIMessage(content=ai_response)]},
+                    as_node='chatbot'
+                )
+                produced = True
+                yield ai_response
+            elif stream:
+                # 流式调用AI，逐个转发模型输出的token
+                parts = []
+                for chunk, metadata in self.graph.stream(
+                    {'messages': [HumanMessage(content=user_text)]},
+                    config,
+                    stream_mode="messages"
+                ):
+                    if metadata.get('langgraph_node') == 'chatbot' and isinstance(chunk.content, str) and chunk.content:
+                        parts.append(chunk.content)
+                        produced = True
+                        yield chunk.content
+                
+                ai_response = ''.join(parts)
+                self._put_cached_response(cache_key, ai_response)
+            else:
+                # 调用AI获取回复
+                result = self.graph.invoke(
+                    {'messages': [HumanMessage(content=user_text)]},
+                    config
+                )
+                
+                ai_response = result['messages'][-1].content
+                self._put_cached_response(cache_key, ai_response)
+                produced = True
+                yield ai_response
             
             # 记录对话（内部统计，不显示日志）
             # 主要的对话日志由主程序管理
+            self._history_mirror.append({"role": "user", "content": user_text})
+            self._history_mirror.append({"role": "assistant", "content": ai_response})
+            self._save_chat_meta()
             
             # 显示对话统计
             if self.conversation_count % 10 == 0:
                 print(f"💭 对话统计: 已进行 {self.conversation_count} 轮对话")
             
-            return ai_response
-            
         except Exception as e:
-            error_msg = "抱歉，我现在遇到了一些问题，请稍后再试。"
+            error_msg = self.ERROR_MESSAGE
             print(f"❌ AI回复生成失败: {e}")
-            return error_msg
+            if not produced:
+                yield error_msg
+    
+    def _response_cache_key(self, user_text: str):
+        """生成回复缓存键（去除空白和标点，忽略大小写），未启用缓存时返回None"""
+        if self.response_cache_size <= 0:
+            return None
+        normalized = re.sub(r'[\W_]+', '', user_text).lower()
+        return (normalized, self.conversation_summary) if normalized else None
+    
+    def _get_cached_response(self, cache_key) -> Optional[str]:
+        """查询回复缓存"""
+        if cache_key is None:
+            return None
+        entry = self._response_cache.get(cache_key)
+        if entry is None:
+            return None
+        if time.monotonic() - entry[0] > self.response_cache_ttl:
+            del self._response_cache[cache_key]
+            return None
+        self._response_cache.move_to_end(cache_key)
+        return entry[1]
+    
+    def _put_cached_response(self, cache_key, ai_response: str):
+        """写入回复缓存，超出容量时淘汰最久未使用的条目"""
+        if cache_key is None:
+            return
+        self._response_cache[cache_key] = (time.monotonic(), ai_response)
+        self._response_cache.move_to_end(cache_key)
+        while len(self._response_cache) > self.response_cache_size:
+            self._response_cache.popitem(last=False)
     
     def _manage_conversation_history(self, messages: List) -> List:
-        """智能管理对话历史长度"""
-        # 分离系统消息和对话消息
-        system_messages = [msg for msg in messages if isinstance(msg, SystemMessage)]
-        conversation_messages = [msg for msg in messages if not isinstance(msg, SystemMessage)]
+        """智能管理对话历史长度（只处理上次调用之后新增的消息）"""
+        # 线程切换后从头重建窗口
+        if self._dialog_thread != self.thread_id or len(messages) < self._dialog_seen:
+            self._dialog.clear()
+            self._dialog_tokens = 0
+            self._dialog_thread = self.thread_id
+            self._dialog_seen = 0
         
-        # 如果对话消息超过限制，保留最近的对话
-        if len(conversation_messages) > self.max_history_length:
-            print(f"📝 对话历史管理: 保留最近 {self.max_history_length} 轮对话")
-            conversation_messages = conversation_messages[-self.max_history_length:]
+        # 新增的对话消息追加到窗口
+        for msg in messages[self._dialog_seen:]:
+            if not isinstance(msg, SystemMessage):
+                tokens = self._approx_tokens(msg)
+                self._dialog.append((msg, tokens))
+                self._dialog_tokens += tokens
+        self._dialog_seen = len(messages)
         
-        return system_messages + conversation_messages
+        # 如果对话消息超过条数或token限制，从最旧一端移除（至少保留最新一条）
+        trimmed = False
+        while len(self._dialog) > 1 and (len(self._dialog) > self.max_history_length or
+                                         self._dialog_tokens > self.max_history_tokens):
+            self._dialog_tokens -= self._dialog.popleft()[1]
+            trimmed = True
+        if trimmed or self._dialog_seen > self.max_history_length:
+            print(f"📝 对话历史管理: 保留最近 {len(self._dialog)} 条对话 (约 {self._dialog_tokens} tokens)")
+        
+        return [msg for msg, _ in self._dialog]
+    
+    @staticmethod
+    def _approx_tokens(msg) -> int:
+        """估算消息的token数：中文等非ASCII字符约1字1个token，ASCII约4字符1个token"""
+        content = msg.content if isinstance(msg.content, str) else str(msg.content)
+        ascii_chars = len(content.encode('ascii', 'ignore'))
+        return (len(content) - ascii_chars) + ascii_chars // 4 + 4
     
     def _auto_summarize_history(self):
         """自动总结对话历史"""
         try:
-            config = {"configurable": {"thread_id": self.thread_id}}
-            state = self.graph.get_state(config)
+            state = self.graph.get_state(self._config)
             messages = state.values.get('messages', [])
             
+            # 最近几条消息原样带入新线程，其余（自上次整理以来的新增对话）并入摘要
+            dialog = [msg for msg in messages if isinstance(msg, (HumanMessage, AIMessage))]
+            keep = self.summary_keep_messages
+            kept_messages = dialog[-keep:] if keep > 0 else []
+            new_messages = dialog[:len(dialog) - len(kept_messages)]
+            
             # 获取对话内容
             conversation_text = ""
-            for msg in messages:
+            for msg in new_messages:
                 if isinstance(msg, HumanMessage):
                     conversation_text += f"用户: {msg.content}\n"
-                elif isinstance(msg, AIMessage):
+                else:
                     conversation_text += f"助手: {msg.content}\n"
             
             if conversation_text:
-                # 生成对话摘要
-                summary_prompt = f"""请简洁地总结以下对话的关键信息（50字以内）：
+                # 在已有摘要的基础上滚动更新，只需提交新增的对话
+                if self.conversation_summary:
+                    summary_prompt = f"""以下是此前的对话摘要和之后新增的对话，请合并为新的摘要，简洁地保留关键信息（50字以内）：
+
+此前摘要: {self.conversation_summary}
+
+新增对话:
+{conversation_text}
+
+摘要:"""
+                else:
+                    summary_prompt = f"""请简洁地总结以下对话的关键信息（50字以内）：
 
 {conversation_text}
 
@@ -197,40 +421,68 @@ class DeepSeekChatModule:
                 self.conversation_summary = summary_response.content.strip()
                 
                 print(f"📋 对话摘要已生成: {self.conversation_summary}")
+                self._history_mirror.append({"role": "system", "content": f"[对话历史摘要: {self.conversation_summary}]"})
                 
-                # 清理旧的对话历史，保留摘要
-                self._cleanup_old_history()
+                # 清理旧的对话历史，保留摘要和最近的消息
+                self._cleanup_old_history(kept_messages)
                 
         except Exception as e:
             print(f"⚠️ 对话摘要生成失败: {e}")
     
-    def _cleanup_old_history(self):
-        """清理旧的对话历史"""
+    def _cleanup_old_history(self, kept_messages: List = None):
+        """清理旧的对话历史，可将最近的消息带入新线程"""
         try:
             # 创建新的线程ID，但保留摘要信息
             old_thread_id = self.thread_id
-            self.thread_id = uuid.uuid4().hex
+            self._set_thread(uuid.uuid4().hex)
             
-            # 静默清理对话历史
-            pass
+            if kept_messages:
+                self.graph.update_state(
+                    self._config,
+                    {'messages': kept_messages},
+                    as_node='chatbot'
+                )
+            
+            # 静默清理对话历史：删除旧线程的检查点，释放内存
+            self._delete_thread(old_thread_id)
+            self._save_chat_meta()
             
         except Exception as e:
             # 静默处理清理失败
             pass
     
+    def _set_thread(self, thread_id: str):
+        """切换当前对话线程并更新复用的线程配置"""
+        self.thread_id = thread_id
+        self._config = {"configurable": {"thread_id": thread_id}}
+    
+    def _delete_thread(self, thread_id: str):
+        """删除指定线程在检查点保存器中的全部状态"""
+        if hasattr(self.checkpointer, 'delete_thread'):
+            self.checkpointer.delete_thread(thread_id)
+    
     def reset_conversation(self):
         """重置对话历史"""
-        self.thread_id = uuid.uuid4().hex
+        try:
+            self._delete_thread(self.thread_id)
+        except Exception:
+            pass  # 删除旧状态失败不影响重置
+        self._set_thread(uuid.uuid4().hex)
         self.conversation_count = 0
         self.conversation_summary = ""
+        self._response_cache.clear()
+        self._history_mirror.clear()
+        self._save_chat_meta()
         print("🔄 对话历史已完全重置")
     
     def get_conversation_history(self) -> List[Dict[str, str]]:
-        """获取对话历史"""
-        config = {"configurable": {"thread_id": self.thread_id}}
-        
+        """获取对话历史（最近 max_history_length 轮，摘要处以system条目标记）"""
+        return list(self._history_mirror)
+    
+    def _read_thread_history(self) -> List[Dict[str, str]]:
+        """从检查点读取当前线程的对话历史（仅启动恢复时使用）"""
         try:
-            state = self.graph.get_state(config)
+            state = self.graph.get_state(self._config)
             messages = state.values.get('messages', [])
             
             history = []
@@ -261,8 +513,12 @@ class DeepSeekChatModule:
         }
         
         try:
-            with open(filename, 'w', encoding='utf-8') as f:
-                json.dump(conversation_data, f, ensure_ascii=False, indent=2)
+            if orjson is not None:
+                with open(filename, 'wb') as f:
+                    f.write(orjson.dumps(conversation_data, option=orjson.OPT_INDENT_2))
+            else:
+                with open(filename, 'w', encoding='utf-8') as f:
+                    json.dump(conversation_data, f, ensure_ascii=False, indent=2)
         
             print(f"💾 对话已保存到: {filename}")
             return filename
@@ -6,6 +6,10 @@
 
 import os
 import argparse
+import collections
+import concurrent.futures
+import queue
+import re
 import time
 import threading
 import asyncio
@@ -20,6 +24,30 @@ from deepseek_chat import DeepSeekChatModule
 from tts_processor import TTSProcessor
 from conversation_manager import ConversationManager
 
+# 句末标点（流式回复按句送入TTS）
+_SENTENCE_END_RE = re.compile(r'[。！？!?\n]+')
+# 设备名中的ALSA硬件标识（如 "USB Audio (hw:1,1)"）
+_HW_RE = re.compile(r'\((hw:\d+,\d+)\)')
+# 环境变量中表示开启的取值
+_TRUTHY = frozenset({'true', '1', 'yes', 'on'})
+# 停止时等待进行中的AI回复收尾的最长时间（秒）
+_AI_STOP_TIMEOUT = 1.0
+
+def _truthy(value):
+    """判断环境变量字符串是否表示开启"""
+    return value.lower() in _TRUTHY
+
+def _split_sentences(buffer):
+    """从缓冲文本中切出完整的句子，返回 (句子列表, 剩余文本)"""
+    sentences = []
+    start = 0
+    for match in _SENTENCE_END_RE.finditer(buffer):
+        sentence = buffer[start:match.end()].strip()
+        if sentence:
+            sentences.append(sentence)
+        start = match.end()
+    return sentences, buffer[start:]
+
 class VoiceChatSystem:
     def __init__(self, args):
         self.has_exception = False  # 跟踪是否发生异常
@@ -31,11 +59,17 @@ class VoiceChatSystem:
         try:
             # 可配置的历史管理参数
             max_history = getattr(args, 'max_history', 20)
+            max_history_tokens = getattr(args, 'max_history_tokens', 8000)
             auto_summarize = getattr(args, 'auto_summarize', 50)
+            response_cache = getattr(args, 'response_cache', 0)
+            checkpoint_db = getattr(args, 'checkpoint_db', '') or None
             
             self.ai_chat = DeepSeekChatModule(
                 max_history_length=max_history,
-                auto_summarize_threshold=auto_summarize
+                max_history_tokens=max_history_tokens,
+                auto_summarize_threshold=auto_summarize,
+                response_cache_size=response_cache,
+                checkpoint_db=checkpoint_db
             )
         except Exception as e:
             print(f"❌ AI 模块初始化失败: {e}")
@@ -45,6 +79,12 @@ class VoiceChatSystem:
         print("💬 初始化对话记录管理器...")
         self.conversation_manager = ConversationManager(max_conversations=20)  # 减少到20个对话记录
         
+        # 会话记录由后台线程逐轮追加写入（首条记录时才创建文件），退出时无需整体导出
+        self._transcript_file = self.conversation_manager.conversation_dir / f"session_{time.strftime('%Y%m%d_%H%M%S')}.txt"
+        self._writer_q = queue.Queue()
+        self._writer_thread = threading.Thread(target=self._transcript_writer, daemon=True)
+        self._writer_thread.start()
+        
         # 初始化TTS模块（默认启用）
         self.tts_enabled = not getattr(args, 'disable_tts', False)
         self.tts = None
@@ -63,6 +103,8 @@ class VoiceChatSystem:
                     max_cache_files=5  # 减少TTS缓存到5个文件
                 )
                 print(f"✅ TTS模块初始化成功")
+                # 后台预合成出错提示语，同时预热到TTS服务的连接
+                self.tts.prewarm([DeepSeekChatModule.ERROR_MESSAGE])
             except Exception as e:
                 print(f"⚠️ TTS 模块初始化失败: {e}")
                 self.tts_enabled = False
@@ -78,8 +120,7 @@ class VoiceChatSystem:
             device_id = args.device_id
         
         # 列出可用设备（debug级别）
-        import os
-        if os.getenv('DEBUG', '').lower() in ['true', '1', 'yes']:
+        if _truthy(os.getenv('DEBUG', '')):
             self.device_manager.list_audio_devices(device_id)
         
         # 录制设备初始化成功提示
@@ -101,7 +142,8 @@ class VoiceChatSystem:
             save_recordings=True,  # 启用录制文件保存
             recording_cache_dir="recording_cache",
             max_cache_files=5,  # 减少到5个文件，及时清理
-            device=args.device  # 传递设备参数
+            device=args.device,  # 传递设备参数
+            asr_compile=args.asr_compile
         )
         
         # 设置回调函数
@@ -111,9 +153,14 @@ class VoiceChatSystem:
             on_recognition=self.on_recognition_result
         )
         
-        # 对话历史存储（线程安全）
-        self.conversation_log = []
-        self._conversation_lock = threading.Lock()  # 保护对话日志的线程锁
+        # 最近对话记录（deque追加为原子操作，无需加锁；只保留最近100轮）
+        self.conversation_log = collections.deque(maxlen=100)
+        self.conversation_turns = 0  # 累计对话轮数（不受保留上限影响）
+        
+        # AI对话单线程池：复用同一工作线程，多句话按到达顺序依次回复
+        self._ai_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="ai")
+        self._ai_futures = set()  # 尚未完成的AI回复，停止时短暂等待进行中的一轮
+        self._stopping = threading.Event()  # 系统停止后不再播报剩余句子
         
         # 显示系统配置
         print("📋 系统配置:")
@@ -122,8 +169,7 @@ class VoiceChatSystem:
         device_info = self.device_manager.get_device_info(device_id)
         if device_info and 'hw:' in device_info['name']:
             # 提取hw设备名（如hw:1,1）
-            import re
-            hw_match = re.search(r'\((hw:\d+,\d+)\)', device_info['name'])
+            hw_match = _HW_RE.search(device_info['name'])
             hw_name = hw_match.group(1) if hw_match else f"hw:设备{device_id}"
         else:
             hw_name = f"hw:设备{device_id}"
@@ -168,11 +214,42 @@ class VoiceChatSystem:
         
         # 🚀 使用线程处理AI对话和TTS，提高实时性
         def process_ai_response():
+            tts_thread = None
             try:
                 print("🤖 AI思考中...")
-                ai_response = self.ai_chat.get_ai_response(text)
                 
-                print(f"🤖 AI回复: {ai_response}")
+                # TTS启用时，按句子边界把流式回复送入播报线程，边生成边播放
+                tts_active = bool(self.tts_enabled and self.tts)
+                sentence_queue = queue.Queue()
+                tts_files = []
+                if tts_active:
+                    tts_thread = threading.Thread(
+                        target=self._speak_sentences,
+                        args=(sentence_queue, tts_files),
+                        daemon=True
+                    )
+                    tts_thread.start()
+                
+                parts = []
+                pending = ""
+                print("🤖 AI回复: ", end="", flush=True)
+                try:
+                    for delta in self.ai_chat.get_ai_response_stream(text):
+                        print(delta, end="", flush=True)
+                        parts.append(delta)
+                        if tts_active:
+                            sentences, pending = _split_sentences(pending + delta)
+                            for sentence in sentences:
+                                sentence_queue.put(sentence)
+                finally:
+                    print()
+                    if tts_active:
+                        # 剩余不以句末标点结尾的文本也要播报
+                        if pending.strip():
+                            sentence_queue.put(pending.strip())
+                        sentence_queue.put(None)
+                
+                ai_response = ''.join(parts)
                 
                 # 创建对话记录（先不包含TTS文件）
                 conversation_id = self.conversation_manager.create_conversation_record(
@@ -189,79 +266,92 @@ class VoiceChatSystem:
                     'conversation_id': conversation_id,
                     'recording_file': recording_file
                 }
-                with self._conversation_lock:
-                    self.conversation_log.append(conversation_entry)
+                self.conversation_log.append(conversation_entry)
+                self.conversation_turns += 1
                 
-                # TTS语音播报（如果启用） - 同步顺序执行
-                if self.tts_enabled and self.tts:
-                    print("🔊 生成回复音频...", end="", flush=True)
-                    try:
-                        # 使用TTS的同步包装函数，避免事件循环冲突
-                        from tts_processor import run_tts_async
-                        # 录制已在录制完成时暂停
-                        try:
-                            # 获取TTS缓存文件路径
-                            tts_file = run_tts_async(self.tts.speak(ai_response))
-                            
-                            # 更新对话记录的TTS文件，获取文件名
-                            tts_filename = None
-                            if conversation_id and hasattr(self.tts, '_get_cached_audio'):
-                                # 尝试获取最近生成的TTS文件
-                                cached_audio = self.tts._get_cached_audio(ai_response)
-                                if cached_audio:
-                                    self.conversation_manager.update_conversation_tts_silent(conversation_id, cached_audio)
-                                    conversation_entry['tts_file'] = cached_audio
-                                    from pathlib import Path
-                                    tts_filename = Path(cached_audio).name
-                            
-                            # 显示TTS文件名
-                            if tts_filename:
-                                print(f" -> {tts_filename}")
-                            
-                            print("✅ 播放完成")
-                            print("-" * 40)
-                        finally:
-                            # TTS完成后恢复录制
-                            try:
-                                if self.recorder:
-                                    self.recorder.resume_recording()
-                            except Exception as e:
-                                print(f"⚠️ 恢复录制失败: {e}")
-                    except Exception as e:
-                        print(f"❌ TTS播报失败: {e}")
-                        print("💬 AI回复（文字）: " + ai_response)
-                        print("-" * 40)  # 分割线
-                        # TTS失败时也要恢复录制
-                        try:
-                            if self.recorder:
-                                self.recorder.resume_recording()
-                        except Exception as e:
-                            print(f"⚠️ 恢复录制失败: {e}")
-                else:
-                    # TTS未启用，直接恢复录制
-                    try:
-                        if self.recorder:
-                            self.recorder.resume_recording()
-                    except Exception as e:
-                        print(f"⚠️ 恢复录制失败: {e}")
+                # 回复文本完整后立即交给写入线程，播报中途停止也不会丢失本轮记录；
+                # TTS文件在播放结束后另起一行补记
+                record = self.conversation_manager.get_conversation_record(conversation_id) if conversation_id else None
+                if record:
+                    self._writer_q.put(self.conversation_manager.format_txt_record(record, include_tts=not tts_active))
+                
+                # TTS语音播报（如果启用） - 等待所有句子播放完成
+                if tts_active:
+                    tts_thread.join()
+                    
+                    # 更新对话记录的TTS文件（按播放顺序记录每一句的音频）
+                    if conversation_id and tts_files:
+                        self.conversation_manager.update_conversation_tts_silent(conversation_id, list(tts_files))
+                        conversation_entry['tts_file'] = list(tts_files)
+                        self._writer_q.put(f"{conversation_id} TTS文件: {', '.join(tts_files)}\n\n")
+                        print(f"🔊 回复音频 -> {', '.join(Path(f).name for f in tts_files)}")
+                    
+                    print("✅ 播放完成")
+                    print("-" * 40)
                 
                 # 对话记录已由conversation_manager统一管理
                 
             except Exception as e:
                 print(f"❌ AI回复生成失败: {e}")
                 print("-" * 40)  # 分割线
-                # AI回复失败时也要恢复录制
+            finally:
+                # 出错时已入队的句子仍在播放，等播完再恢复录制，避免录入自己的声音
+                if tts_thread is not None:
+                    tts_thread.join()
+                
+                # TTS完成（或未启用）后恢复录制，AI回复失败时也要恢复
                 try:
                     if self.recorder:
                         self.recorder.resume_recording()
-                except Exception as resume_e:
-                    print(f"⚠️ 恢复录制失败: {resume_e}")
+                except Exception as e:
+                    print(f"⚠️ 恢复录制失败: {e}")
         
-        # 在新线程中处理AI对话，避免阻塞语音识别
-        ai_thread = threading.Thread(target=process_ai_response, daemon=True)
-        ai_thread.start()
+        # 交给AI工作线程处理，避免阻塞语音识别
+        future = self._ai_executor.submit(process_ai_response)
+        self._ai_futures.add(future)
+        future.add_done_callback(self._ai_futures.discard)
     
 
+    def _speak_sentences(self, sentence_queue, tts_files):
+        """TTS播报线程 - 依次合成并播放队列中的句子，收到None时结束"""
+        # 使用TTS的同步包装函数，避免事件循环冲突
+        from tts_processor import run_tts_async
+        while True:
+            sentence = sentence_queue.get()
+            if sentence is None:
+                break
+            if self._stopping.is_set():
+                continue  # 系统停止中，丢弃剩余句子
+            try:
+                # speak返回播放的缓存文件路径，无需再查一次缓存
+                audio_file = run_tts_async(self.tts.speak(sentence))
+                if audio_file:
+                    tts_files.append(audio_file)
+            except Exception as e:
+                print(f"❌ TTS播报失败: {e}")
+    
+    def _transcript_writer(self):
+        """会话记录写入线程 - 逐条追加并落盘，收到None时结束"""
+        f = None
+        try:
+            while True:
+                text = self._writer_q.get()
+                if text is None:
+                    break
+                if f is None:
+                    # 没有对话的会话不生成只有标题的空记录文件
+                    f = open(self._transcript_file, 'a', encoding='utf-8')
+                    f.write("对话记录导出\n")
+                    f.write("=" * 50 + "\n\n")
+                f.write(text)
+                f.flush()
+                os.fsync(f.fileno())
+        except Exception as e:
+            print(f"⚠️ 会话记录写入失败: {e}")
+        finally:
+            if f is not None:
+                f.close()
+    
     def start(self):
         """启动语音对话AI系统"""
         print("\n🚀 启动语音对话AI系统...")
@@ -290,6 +380,16 @@ class VoiceChatSystem:
         except Exception as e:
             print(f"⚠️ 停止录制器失败: {e}")
         
+        # 停止播报，丢弃尚未开始的AI回复；进行中的一轮只短暂等待收尾，不阻塞退出
+        # （该轮回复文本在播报前已写入会话记录）
+        if hasattr(self, '_stopping'):
+            self._stopping.set()
+        if getattr(self, 'tts', None):
+            self.tts.stop()
+        if hasattr(self, '_ai_executor'):
+            self._ai_executor.shutdown(wait=False, cancel_futures=True)
+            concurrent.futures.wait(list(self._ai_futures), timeout=_AI_STOP_TIMEOUT)
+        
         # 显示统计信息
         print(f"\n📊 本次会话统计:")
         
@@ -298,8 +398,7 @@ class VoiceChatSystem:
             recording_stats = self.recorder.get_recording_stats() if hasattr(self, 'recorder') and self.recorder else {
                 'successful_recognitions': 0, 'failed_recognitions': 0, 'short_recordings': 0
             }
-            with self._conversation_lock if hasattr(self, '_conversation_lock') else threading.Lock():
-                conversation_count = len(self.conversation_log) if hasattr(self, 'conversation_log') else 0
+            conversation_count = getattr(self, 'conversation_turns', 0)
             print(f"💬 对话轮数: {conversation_count}轮")
             print(f"📊 识别统计: 成功{recording_stats['successful_recognitions']}次 | 失败{recording_stats['failed_recognitions']}次 | 过短{recording_stats['short_recordings']}次")
         except Exception as e:
@@ -309,21 +408,25 @@ class VoiceChatSystem:
         
         # 最近对话记录
         try:
-            with self._conversation_lock if hasattr(self, '_conversation_lock') else threading.Lock():
-                if hasattr(self, 'conversation_log') and self.conversation_log:
-                    print(f"\n最近对话:")
-                    for entry in self.conversation_log[-2:]:  # 显示最近2轮对话
-                        user_text = entry['user_speech'][:30] + "..." if len(entry['user_speech']) > 30 else entry['user_speech']
-                        ai_text = entry['ai_response'][:30] + "..." if len(entry['ai_response']) > 30 else entry['ai_response']
-                        print(f"  👤 {user_text} → 🤖 {ai_text}")
+            recent_entries = list(getattr(self, 'conversation_log', ()))[-2:]  # 一次性快照，显示最近2轮对话
+            if recent_entries:
+                print(f"\n最近对话:")
+                for entry in recent_entries:
+                    user_text = entry['user_speech'][:30] + "..." if len(entry['user_speech']) > 30 else entry['user_speech']
+                    ai_text = entry['ai_response'][:30] + "..." if len(entry['ai_response']) > 30 else entry['ai_response']
+                    print(f"  👤 {user_text} → 🤖 {ai_text}")
         except Exception as e:
             print(f"⚠️ 显示对话记录失败: {e}")
         
-        # 保存对话记录
+        # 会话记录已逐轮写入，这里只需结束写入线程
         try:
-            if hasattr(self, 'conversation_manager') and self.conversation_manager:
-                export_file = self.conversation_manager.export_conversations('txt')
-                print(f"\n📁 已保存至: {Path(export_file).name}")
+            if hasattr(self, '_writer_thread'):
+                self._writer_q.put(None)
+                self._writer_thread.join(timeout=1)
+                if self._transcript_file.exists():
+                    print(f"\n📁 已保存至: {self._transcript_file.name}")
+                else:
+                    print("\n📁 本次会话无对话，未生成会话记录")
             else:
                 print(f"\n⚠️ 对话管理器不可用，跳过保存")
         except Exception as e:
@@ -349,7 +452,7 @@ def main():
     parser.add_argument('--min-duration', type=float, default=float(os.getenv('MIN_SPEECH_DURATION', '0.5')), 
                        help='最小语音时长(秒)')
     parser.add_argument('--disable-asr', action='store_true', 
-                       default=os.getenv('DISABLE_ASR', '').lower() in ['true', '1', 'yes'],
+                       default=_truthy(os.getenv('DISABLE_ASR', '')),
                        help='禁用语音识别（仅录音）')
     parser.add_argument('--queue-size', type=int, default=int(os.getenv('ASR_QUEUE_SIZE', '20')), 
                        help='ASR队列大小')
@@ -357,24 +460,33 @@ def main():
     # 对话管理参数
     parser.add_argument('--max-history', type=int, default=int(os.getenv('MAX_HISTORY', '20')),
                        help='最大保留的对话轮数')
+    parser.add_argument('--max-history-tokens', type=int, default=int(os.getenv('MAX_HISTORY_TOKENS', '8000')),
+                       help='发送给模型的历史消息估算token上限')
     parser.add_argument('--auto-summarize', type=int, default=int(os.getenv('AUTO_SUMMARIZE', '50')),
                        help='自动总结触发的对话轮数')
+    parser.add_argument('--response-cache', type=int, default=int(os.getenv('RESPONSE_CACHE_SIZE', '0')),
+                       help='相同问题回复缓存条数 (0=不启用)')
+    parser.add_argument('--checkpoint-db', type=str, default=os.getenv('CHAT_CHECKPOINT_DB', ''),
+                       help='对话状态SQLite数据库路径，重启后恢复上下文 (为空=仅内存)')
     
     # TTS参数
     parser.add_argument('--disable-tts', action='store_true',
-                       default=os.getenv('DISABLE_TTS', '').lower() in ['true', '1', 'yes'],
+                       default=_truthy(os.getenv('DISABLE_TTS', '')),
                        help='禁用TTS语音播报')
     parser.add_argument('--tts-device', default=os.getenv('DEFAULT_TTS_DEVICE', 'default'),
                        help='TTS音频播放设备 (默认: default)')
     parser.add_argument('--playback-device-id', type=int, default=None,
                        help='sounddevice播放设备ID (优先级高于tts-device)')
     parser.add_argument('--use-aplay', action='store_true',
-                       default=os.getenv('USE_APLAY', '').lower() in ['true', '1', 'yes'],
+                       default=_truthy(os.getenv('USE_APLAY', '')),
                        help='强制使用aplay播放而非sounddevice')
     
     # AI模型参数
     parser.add_argument('--device', default=os.getenv('DEVICE', 'cpu'),
                        help='AI模型运行设备 (cpu/cuda:0/auto)')
+    parser.add_argument('--asr-compile', action='store_true',
+                       default=_truthy(os.getenv('ASR_COMPILE', '')),
+                       help='GPU上用torch.compile编译语音识别模型')
     
     args = parser.parse_args()
     
@@ -3,14 +3,16 @@
 语音识别模块
 """
 
-import tempfile
+import contextlib
 import time
 import wave
+import numpy as np
+import torch
 from funasr import AutoModel
 
 class SpeechRecognizer:
     def __init__(self, model_dir="iic/SenseVoiceSmall", 
-                 samplerate=16000, device="cpu"):
+                 samplerate=16000, device="cpu", compile_model=False):
         """
         初始化语音识别器
         
@@ -18,19 +20,23 @@ class SpeechRecognizer:
             model_dir: 模型目录路径
             samplerate: 采样率
             device: 运行设备 (cpu/cuda)
+            compile_model: GPU上是否用torch.compile编译模型（首次识别较慢）
         """
         self.model_dir = model_dir
         self.samplerate = samplerate
         
         # 设备检测和设置
         if device == "auto":
-            import torch
             self.device = "cuda:0" if torch.cuda.is_available() else "cpu"
             print(f"🔍 自动检测设备: {self.device}")
         else:
             self.device = device
             
+        self.compile_model = compile_model
         self.model_sensevoice = None
+        # 常驻的float32波形暂存区（30秒），短语音直接写入，避免每次分配
+        # （funasr在CPU上计算fbank后自行拷贝到设备，因此无需锁页内存）
+        self._staging = np.empty(samplerate * 30, dtype=np.float32)
         
         self.init_model()
     
@@ -44,6 +50,8 @@ class SpeechRecognizer:
                 device=self.device
             )
             print(f'✅ SenseVoice模型加载成功 (设备: {self.device})')
+            if self.compile_model and self.device.startswith("cuda"):
+                self._compile_model()
             return True
         except Exception as e:
             print(f'❌ SenseVoice模型加载失败: {e}')
@@ -57,17 +65,47 @@ class SpeechRecognizer:
                 wav_file.setnchannels(1)  # 单声道
                 wav_file.setsampwidth(2)  # 16位
                 wav_file.setframerate(self.samplerate)
+                if isinstance(audio_data, np.ndarray):
+                    # 直接写入数组内存，仅在文件边界转换为小端int16
+                    audio_data = np.ascontiguousarray(audio_data, dtype='<i2')
                 wav_file.writeframes(audio_data)
         except Exception as e:
             print(f"❌ WAV文件写入失败: {e}")
             raise
     
+    def _compile_model(self):
+        """用torch.compile编译声学模型，失败时保持原模型"""
+        try:
+            self.model_sensevoice.model = torch.compile(self.model_sensevoice.model, dynamic=True)
+            print('⚡ SenseVoice模型已启用torch.compile')
+        except Exception as e:
+            print(f'⚠️ torch.compile不可用，使用原模型: {e}')
+    
+    def _precision_context(self):
+        """GPU上以FP16混合精度推理，CPU保持FP32"""
+        if self.device.startswith("cuda"):
+            return torch.autocast(device_type="cuda", dtype=torch.float16)
+        return contextlib.nullcontext()
+    
+    def _generate(self, audio_input, **kwargs):
+        """使用SenseVoice进行识别"""
+        with torch.inference_mode(), self._precision_context():
+            return self.model_sensevoice.generate(
+                input=audio_input,
+                cache={},  # 非流式模型，每次调用使用独立缓存，避免语音段之间串扰
+                language="zn",  # 中文
+                use_itn=False,
+                disable_pbar=True,  # 禁用进度条
+                disable_log=True,   # 禁用日志
+                **kwargs
+            )
+    
     def recognize_from_memory(self, audio_data):
         """
         从内存中的音频数据进行语音识别
         
         Args:
-            audio_data: 音频数据 (bytes)
+            audio_data: 音频数据 (int16单声道np.ndarray 或 bytes)
             
         Returns:
             str: 识别结果文本，失败返回None
@@ -77,32 +115,15 @@ class SpeechRecognizer:
                 print("SenseVoice模型未加载，跳过语音识别")
                 return None
             
-            # 使用临时文件进行识别（自动清理）
-            with tempfile.NamedTemporaryFile(suffix='.wav', delete=True) as temp_file:
-                # 写入音频数据到临时文件
-                self.save_wav_file(temp_file.name, audio_data)
-                
-                # 使用SenseVoice进行识别
-                res = self.model_sensevoice.generate(
-                    input=temp_file.name,
-                    cache={},
-                    language="zn",  # 中文
-                    use_itn=False,
-                    disable_pbar=True,  # 禁用进度条
-                    disable_log=True,   # 禁用日志
-                )
-                
-                # 提取识别结果文本
-                if res and len(res) > 0:
-                    recognized_text = res[0]['text'].split(">")[-1].strip()
-                    
-                    if recognized_text:
-                        return recognized_text
-                    else:
-                        return None
-                else:
-                    print("⚠️ 识别返回结果为空")
-                    return None
+            # 数组直接作为波形输入，免去临时WAV文件的写入与重新解析
+            res = self._generate(self._to_waveform(audio_data, self._staging), fs=self.samplerate)
+            
+            # 提取识别结果文本
+            if res and len(res) > 0:
+                return self._extract_text(res[0])
+            else:
+                print("⚠️ 识别返回结果为空")
+                return None
             
         except Exception as e:
             print(f"❌ 语音识别失败: {e}")
@@ -115,6 +136,50 @@ class SpeechRecognizer:
                     print("❌ 模型重新初始化失败")
             return None
     
+    def recognize_batch(self, audio_list):
+        """
+        批量识别多段音频，一次前向推理处理整批（由模型内部补齐长度）
+        
+        Args:
+            audio_list: 音频数据列表 (int16单声道np.ndarray 或 bytes)
+            
+        Returns:
+            list: 与输入一一对应的识别文本，失败项为None
+        """
+        if self.model_sensevoice is None:
+            print("SenseVoice模型未加载，跳过语音识别")
+            return [None] * len(audio_list)
+        if len(audio_list) <= 1:
+            return [self.recognize_from_memory(audio_data) for audio_data in audio_list]
+        
+        try:
+            waveforms = [self._to_waveform(audio_data) for audio_data in audio_list]
+            res = self._generate(waveforms, fs=self.samplerate, batch_size=len(waveforms))
+            if res and len(res) == len(audio_list):
+                return [self._extract_text(item) for item in res]
+            print("⚠️ 批量识别结果数量不符，改为逐条识别")
+        except Exception as e:
+            print(f"⚠️ 批量识别失败，改为逐条识别: {e}")
+        
+        return [self.recognize_from_memory(audio_data) for audio_data in audio_list]
+    
+    def _to_waveform(self, audio_data, out=None):
+        """int16音频转换为模型输入的float32波形，可写入给定暂存区避免每次分配"""
+        if not isinstance(audio_data, np.ndarray):
+            # bytes零拷贝视为int16数组
+            audio_data = np.frombuffer(audio_data, dtype='<i2')
+        n = audio_data.size
+        if out is None or n > out.size:
+            return audio_data.astype(np.float32) / 32768.0
+        waveform = out[:n]
+        np.multiply(audio_data, 1.0 / 32768.0, out=waveform, casting='unsafe')
+        return waveform
+    
+    def _extract_text(self, result):
+        """从识别结果中去掉语言/情感等标签，空文本返回None"""
+        recognized_text = result['text'].split(">")[-1].strip()
+        return recognized_text or None
+    
     def is_model_loaded(self):
         """检查模型是否已加载"""
         return self.model_sensevoice is not None
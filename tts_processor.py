@@ -9,16 +9,20 @@ TTS处理器模块 - 智能文本转语音
 """
 
 import asyncio
+import atexit
+import collections
 import tempfile
 import os
 import time
 import re
 import subprocess
 import hashlib
+import heapq
 import json
 from typing import List, Dict, Optional
 import threading
 import queue
+from functools import lru_cache
 from pathlib import Path
 import wave
 import numpy as np
@@ -27,17 +31,49 @@ try:
     import edge_tts
     import sounddevice as sd
     
-    # 禁用pygame的欢迎信息
-    import os
-    os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = '1'
-    import pygame
-    
     TTS_AVAILABLE = True
     pass  # Edge-TTS 可用
 except ImportError as e:
     TTS_AVAILABLE = False
     print(f"❌ TTS依赖不可用: {e}")
-    print("   请安装: pip install edge-tts pygame sounddevice")
+    print("   请安装: pip install edge-tts sounddevice")
+
+try:
+    import xxhash  # 可选：更快的非加密哈希
+except ImportError:
+    xxhash = None
+
+try:
+    import av  # 可选：进程内解码MP3，免去每次合成启动ffmpeg
+except ImportError:
+    av = None
+
+# 语义分割：句末标点、逗号分号及转折/顺序连接词，一次切分
+_SEMANTIC_SPLIT_RE = re.compile(r'[。！？，；]|但是|然而|另外|首先|其次|最后|因此|所以')
+
+@lru_cache(maxsize=1)
+def _query_devices():
+    """枚举音频设备（ALSA下较慢，进程内只枚举一次，所有实例共用）"""
+    return sd.query_devices()
+
+# 缓存音频格式：与语音识别一致的16kHz双声道16位PCM
+TTS_SAMPLERATE = 16000
+TTS_CHANNELS = 2
+# 进程内写入的缓存文件使用该后缀，格式固定（44字节标准WAV头），读取时可跳过头部解析
+_CACHE_PCM_SUFFIX = '.c16s2.wav'
+
+# 缓存键使用的哈希算法，记录在索引条目中，更换算法后旧条目失效
+_HASH_ALGO = 'xxh3_128' if xxhash is not None else 'md5'
+# 缓存键格式版本，键的组成方式变化时递增，旧条目随之失效
+CACHE_KEY_VERSION = 2
+
+
+def _normalize_percent(value) -> str:
+    """将语速/音量参数规范为 "+N%" 形式，使 "+0%"、"0%"、"+00%" 共用缓存"""
+    try:
+        return f"{int(str(value).strip().rstrip('%')):+d}%"
+    except ValueError:
+        return str(value)
 
 class TTSProcessor:
     """智能TTS处理器 - 带音频缓存"""
@@ -67,7 +103,7 @@ class TTSProcessor:
             use_sounddevice: 是否使用sounddevice播放 (新增)
         """
         if not TTS_AVAILABLE:
-            raise ImportError("请先安装TTS依赖: pip install edge-tts pygame sounddevice")
+            raise ImportError("请先安装TTS依赖: pip install edge-tts sounddevice")
         
         self.voice = voice
         self.rate = rate
@@ -82,14 +118,28 @@ class TTSProcessor:
         self.cache_dir = Path(cache_dir)
         self.cache_dir.mkdir(exist_ok=True)
         self.cache_index_file = self.cache_dir / "cache_index.json"
+        # 最近播放的缓存音频保留解码后的PCM，重复播放时无需读盘和解析WAV
+        self._hot_audio = collections.OrderedDict()  # 文件路径 -> (音频数据, 采样率, 声道数)
+        self._hot_audio_size = 8
+        # 缓存命中只追加一行访问记录，不重写整个索引；索引保存时清空
+        self.cache_access_file = self.cache_dir / "cache_access.jsonl"
+        self._access_log = None
         self.cache_index = self._load_cache_index()
+        access_count = self._replay_access_log()
+        self._access_log = open(self.cache_access_file, 'a', encoding='utf-8')
+        if access_count:
+            self._save_cache_index()
+        self._drop_stale_hash_entries()
+        # 索引改动只标记为脏，由后台线程每2秒落盘一次，进程退出时再保存一次
+        self._index_lock = threading.Lock()
+        self._dirty = False
+        threading.Thread(target=self._index_flush_worker, daemon=True).start()
+        atexit.register(self._flush_cache_index)
         
-        # 配置播放设备
-        self._configure_playback_device()
+        # 播放设备在首次播放时再配置，避免启动时枚举设备
+        self._playback_configured = False
         
-        # 语音队列和控制
-        self.audio_queue = queue.Queue()
-        self.is_playing = False
+        # 播放控制
         self.stop_playing = threading.Event()
         
         # 启动时清理缓存，确保文件数量在限制内
@@ -101,6 +151,12 @@ class TTSProcessor:
         print(f"📂 当前缓存文件: {len(self.cache_index)} / {self.max_cache_files}")
         # 播放设备信息在_configure_playback_device中显示
     
+    def _ensure_playback_device(self):
+        """首次播放前配置播放设备"""
+        if not self._playback_configured:
+            self._playback_configured = True
+            self._configure_playback_device()
+    
     def _configure_playback_device(self):
         """配置播放设备"""
         if self.use_sounddevice:
@@ -111,7 +167,7 @@ class TTSProcessor:
                 
                 # 验证设备是否可用
                 if self.audio_device_id is not None:
-                    devices = sd.query_devices()
+                    devices = _query_devices()
                     if self.audio_device_id < len(devices):
                         device_info = devices[self.audio_device_id]
                         if device_info['max_output_channels'] > 0:
@@ -124,7 +180,7 @@ class TTSProcessor:
                 # 使用默认输出设备
                 if self.audio_device_id is None:
                     self.audio_device_id = sd.default.device[1]  # 默认输出设备
-                    devices = sd.query_devices()
+                    devices = _query_devices()
                     device_name = devices[self.audio_device_id]['name']
                     print(f"🔊 播放设备: {device_name} (默认)")
                     
@@ -148,7 +204,7 @@ class TTSProcessor:
                 card_num = int(parts[0])
                 
                 # 查找对应的sounddevice设备
-                devices = sd.query_devices()
+                devices = _query_devices()
                 for idx, device in enumerate(devices):
                     if f"card {card_num}" in device['name'].lower() and device['max_output_channels'] > 0:
                         return idx
@@ -156,12 +212,12 @@ class TTSProcessor:
             # 如果是数字ID
             if alsa_device.isdigit():
                 device_id = int(alsa_device)
-                devices = sd.query_devices()
+                devices = _query_devices()
                 if 0 <= device_id < len(devices) and devices[device_id]['max_output_channels'] > 0:
                     return device_id
                     
             # 按设备名称搜索
-            devices = sd.query_devices()
+            devices = _query_devices()
             for idx, device in enumerate(devices):
                 if alsa_device.lower() in device['name'].lower() and device['max_output_channels'] > 0:
                     return idx
@@ -174,11 +230,7 @@ class TTSProcessor:
         """设置备选播放器"""
         # 使用系统播放器作为备选
         self.use_system_player = True
-        try:
-            pygame.mixer.init(frequency=22050, size=-16, channels=2, buffer=512)
-        except pygame.error as e:
-            print(f"⚠️ pygame初始化失败: {e}")
-            print("✅ 将使用aplay作为播放器")
+        print("✅ 将使用aplay作为播放器")
     
     def _load_cache_index(self) -> Dict:
         """加载缓存索引"""
@@ -191,33 +243,107 @@ class TTSProcessor:
         return {}
     
     def _save_cache_index(self):
-        """保存缓存索引"""
+        """保存缓存索引（先写临时文件再原子替换，中途崩溃不会损坏索引）"""
         try:
-            with open(self.cache_index_file, 'w', encoding='utf-8') as f:
-                json.dump(self.cache_index, f, ensure_ascii=False, indent=2)
+            tmp_file = self.cache_index_file.with_name(self.cache_index_file.name + '.tmp')
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump(dict(self.cache_index), f, ensure_ascii=False, indent=2)
+            os.replace(tmp_file, self.cache_index_file)
+            # 访问记录已并入索引，清空访问日志
+            if self._access_log is not None:
+                self._access_log.seek(0)
+                self._access_log.truncate()
         except Exception as e:
             print(f"⚠️ 保存缓存索引失败: {e}")
     
+    def _mark_dirty(self):
+        """标记索引有未保存的改动"""
+        self._dirty = True
+    
+    def _flush_cache_index(self):
+        """索引有改动时保存，否则仅把缓冲的访问记录写出"""
+        with self._index_lock:
+            if self._dirty:
+                self._dirty = False
+                self._save_cache_index()
+            else:
+                try:
+                    self._access_log.flush()
+                except Exception:
+                    pass  # 日志已关闭
+    
+    def _index_flush_worker(self):
+        """后台定时落盘缓存索引"""
+        while True:
+            time.sleep(2.0)
+            self._flush_cache_index()
+    
+    def _replay_access_log(self) -> int:
+        """将访问日志中的最近访问时间合并到索引，返回记录数"""
+        count = 0
+        try:
+            if self.cache_access_file.exists():
+                with open(self.cache_access_file, 'r', encoding='utf-8') as f:
+                    for line in f:
+                        try:
+                            record = json.loads(line)
+                        except ValueError:
+                            continue  # 跳过写入中断的残缺行
+                        entry = self.cache_index.get(record.get('hash'))
+                        if entry is not None:
+                            entry['last_access'] = max(entry.get('last_access', 0), record.get('last_access', 0))
+                        count += 1
+        except Exception as e:
+            print(f"⚠️ 回放缓存访问日志失败: {e}")
+        return count
+    
+    def _log_access(self, text_hash: str, last_access: float):
+        """追加一条缓存访问记录（写入缓冲区，由后台线程定时写出）"""
+        try:
+            with self._index_lock:
+                self._access_log.write(json.dumps({'hash': text_hash, 'last_access': last_access}) + '\n')
+        except Exception as e:
+            print(f"⚠️ 写入缓存访问日志失败: {e}")
+    
+    def _drop_stale_hash_entries(self):
+        """删除哈希算法或键格式与当前不一致的缓存条目（键无法再命中）"""
+        stale_keys = [key for key, info in self.cache_index.items()
+                      if info.get('hash_algo', 'md5') != _HASH_ALGO
+                      or info.get('key_version', 1) != CACHE_KEY_VERSION]
+        if not stale_keys:
+            return
+        for key in stale_keys:
+            file_info = self.cache_index.pop(key)
+            try:
+                (self.cache_dir / file_info['filename']).unlink()
+            except Exception:
+                pass  # 文件已不存在
+        self._save_cache_index()
+    
     def _get_text_hash(self, text: str) -> str:
         """生成文本的哈希值作为缓存键"""
-        # 包含语音参数以确保唯一性
-        cache_key = f"{text}|{self.voice}|{self.rate}|{self.volume}"
-        return hashlib.md5(cache_key.encode('utf-8')).hexdigest()
+        # 包含语音参数以确保唯一性（语速/音量规范化后再参与计算）
+        cache_key = (f"v{CACHE_KEY_VERSION}|{text}|{self.voice}|"
+                     f"{_normalize_percent(self.rate)}|{_normalize_percent(self.volume)}").encode('utf-8')
+        # 哈希仅用作缓存键，优先使用xxh3，未安装时回退到MD5
+        if xxhash is not None:
+            return xxhash.xxh3_128_hexdigest(cache_key)
+        return hashlib.md5(cache_key).hexdigest()
     
     def _cleanup_cache(self):
         """清理旧的缓存文件，保持在最大数量限制内"""
         if len(self.cache_index) <= self.max_cache_files:
             return
         
-        # 按访问时间排序，删除最旧的文件
-        sorted_items = sorted(
-            self.cache_index.items(), 
+        # 只选出访问时间最旧的若干条，无需对整个索引排序
+        files_to_remove = len(self.cache_index) - self.max_cache_files
+        oldest_items = heapq.nsmallest(
+            files_to_remove,
+            self.cache_index.items(),
             key=lambda x: x[1].get('last_access', 0)
         )
         
-        files_to_remove = len(self.cache_index) - self.max_cache_files
-        for i in range(files_to_remove):
-            hash_key, file_info = sorted_items[i]
+        for hash_key, file_info in oldest_items:
             file_path = self.cache_dir / file_info['filename']
             
             try:
@@ -225,11 +351,12 @@ class TTSProcessor:
                     file_path.unlink()
                     # 静默删除旧缓存
                 del self.cache_index[hash_key]
+                self._hot_audio.pop(str(file_path), None)
             except Exception as e:
                 # 静默处理删除失败
                 pass
         
-        self._save_cache_index()
+        self._mark_dirty()
         # 静默完成清理
     
     def _get_cached_audio(self, text: str) -> Optional[str]:
@@ -241,15 +368,16 @@ class TTSProcessor:
             file_path = self.cache_dir / file_info['filename']
             
             if file_path.exists():
-                # 更新访问时间
-                self.cache_index[text_hash]['last_access'] = time.time()
-                self._save_cache_index()
+                # 更新访问时间（只追加访问记录，不重写索引）
+                now = time.time()
+                self.cache_index[text_hash]['last_access'] = now
+                self._log_access(text_hash, now)
                 # 使用缓存音频
                 return str(file_path)
             else:
                 # 文件不存在，从索引中移除
                 del self.cache_index[text_hash]
-                self._save_cache_index()
+                self._mark_dirty()
         
         return None
     
@@ -265,20 +393,7 @@ class TTSProcessor:
             import shutil
             shutil.copy2(audio_path, cached_path)
             
-            # 更新缓存索引
-            self.cache_index[text_hash] = {
-                'text': text[:50],  # 保存前50个字符用于显示
-                'filename': filename,
-                'created': timestamp,
-                'last_access': timestamp,
-                'voice': self.voice,
-                'rate': self.rate,
-                'volume': self.volume
-            }
-            
-            # 清理旧缓存
-            self._cleanup_cache()
-            self._save_cache_index()
+            self._register_cache_entry(text, text_hash, filename, timestamp)
             
             # 音频已缓存（内部调试信息，不显示）
             return str(cached_path)
@@ -287,6 +402,66 @@ class TTSProcessor:
             print(f"⚠️ 缓存音频失败: {e}")
             return audio_path
     
+    def _cache_pcm(self, text: str, pcm: np.ndarray) -> Optional[str]:
+        """将解码后的PCM直接写入缓存目录的WAV文件"""
+        text_hash = self._get_text_hash(text)
+        timestamp = int(time.time())
+        filename = f"tts_{timestamp}_{text_hash[:8]}{_CACHE_PCM_SUFFIX}"
+        cached_path = self.cache_dir / filename
+        
+        try:
+            with wave.open(str(cached_path), 'wb') as wav_file:
+                wav_file.setnchannels(TTS_CHANNELS)
+                wav_file.setsampwidth(2)
+                wav_file.setframerate(TTS_SAMPLERATE)
+                wav_file.writeframes(np.ascontiguousarray(pcm, dtype='<i2'))
+            
+            self._register_cache_entry(text, text_hash, filename, timestamp)
+            return str(cached_path)
+            
+        except Exception as e:
+            print(f"⚠️ 缓存音频失败: {e}")
+            return None
+    
+    def _register_cache_entry(self, text: str, text_hash: str, filename: str, timestamp: int):
+        """登记缓存索引条目并清理超出数量的旧缓存"""
+        self.cache_index[text_hash] = {
+            'text': text[:50],  # 保存前50个字符用于显示
+            'filename': filename,
+            'created': timestamp,
+            'last_access': timestamp,
+            'voice': self.voice,
+            'rate': self.rate,
+            'volume': self.volume,
+            'hash_algo': _HASH_ALGO,
+            'key_version': CACHE_KEY_VERSION
+        }
+        
+        # 清理旧缓存
+        self._cleanup_cache()
+        self._mark_dirty()
+    
+    def _create_mp3_decoder(self):
+        """
+        创建PyAV增量MP3解码器，输出16kHz双声道int16
+        
+        Returns:
+            decode(data) 函数：传入MP3分片返回新解码出的PCM列表（形状 (帧数, 2)），
+            传入None时冲刷解码器和重采样器中剩余的数据
+        """
+        decoder = av.CodecContext.create('mp3', 'r')
+        resampler = av.AudioResampler(format='s16', layout='stereo', rate=TTS_SAMPLERATE)
+        
+        def decode(data):
+            frames = [frame for packet in decoder.parse(data) for frame in decoder.decode(packet)]
+            if data is None:
+                frames.extend(decoder.decode(None))
+                frames.append(None)  # 冲刷重采样器
+            return [out_frame.to_ndarray().reshape(-1, TTS_CHANNELS)
+                    for frame in frames for out_frame in resampler.resample(frame)]
+        
+        return decode
+    
     def _analyze_text_strategy(self, text: str) -> str:
         """分析文本并决定合成策略 - 统一使用完整合成"""
         # 不再分割，统一使用完整合成保证语音连贯性
@@ -301,39 +476,32 @@ class TTSProcessor:
         
         chunks = []
         
-        # 1. 按强制分割符分割
-        sentences = re.split(r'[。！？]', text)
-        
-        for sentence in sentences:
-            if not sentence.strip():
+        # 1. 按句末标点、逗号和语义词一次分割
+        for part in _SEMANTIC_SPLIT_RE.split(text):
+            part = part.strip()
+            if not part:
                 continue
-                
-            # 2. 按逗号和语义词分割
-            parts = re.split(r'[，；]|但是|然而|另外|首先|其次|最后|因此|所以', sentence)
             
-            for part in parts:
-                part = part.strip()
-                if not part:
-                    continue
+            # 2. 长度保护分割
+            if len(part) > 25:
+                # 按词语边界分割长句，累计长度不超过20
+                current_words = []
+                current_len = 0
                 
-                # 3. 长度保护分割
-                if len(part) > 25:
-                    # 按词语边界分割长句
-                    words = part.split()
-                    current_chunk = ""
-                    
-                    for word in words:
-                        if len(current_chunk + word) <= 20:
-                            current_chunk += word
-                        else:
-                            if current_chunk:
-                                chunks.append(current_chunk.strip())
-                            current_chunk = word
-                    
-                    if current_chunk:
-                        chunks.append(current_chunk.strip())
-                else:
-                    chunks.append(part)
+                for word in part.split():
+                    if current_len + len(word) <= 20:
+                        current_words.append(word)
+                        current_len += len(word)
+                    else:
+                        if current_words:
+                            chunks.append(''.join(current_words))
+                        current_words = [word]
+                        current_len = len(word)
+                
+                if current_words:
+                    chunks.append(''.join(current_words))
+            else:
+                chunks.append(part)
         
         # 过滤空块和过短块
         chunks = [chunk for chunk in chunks if len(chunk.strip()) >= 2]
@@ -348,14 +516,26 @@ class TTSProcessor:
             return cached_path
         
         try:
-            # 创建临时文件用于合成
-            import time
-            import os
-            temp_path = os.path.join(tempfile.gettempdir(), f"tts_temp_{int(time.time()*1000)}.wav")
-            
             # Edge-TTS合成 - 流式转换为设备兼容格式
             communicate = edge_tts.Communicate(text, self.voice, rate=self.rate, volume=self.volume)
             
+            if av is not None:
+                # 进程内边接收边解码MP3，直接写入缓存文件，无需ffmpeg进程和临时文件
+                decode = self._create_mp3_decoder()
+                pcm_parts = []
+                async for chunk in communicate.stream():
+                    if chunk["type"] == "audio":
+                        pcm_parts.extend(decode(chunk["data"]))
+                pcm_parts.extend(decode(None))
+                
+                if not pcm_parts:
+                    print("❌ 生成的音频文件为空")
+                    return None
+                return self._cache_pcm(text, np.concatenate(pcm_parts))
+            
+            # 未安装PyAV时使用ffmpeg转换，先写入临时文件
+            temp_path = os.path.join(tempfile.gettempdir(), f"tts_temp_{int(time.time()*1000)}.wav")
+            
             # 使用ffmpeg转换为与语音识别一致的格式（16kHz双声道）
             import subprocess
             # 使用16kHz双声道，与语音识别设备参数保持一致，避免冲突
@@ -380,21 +560,18 @@ class TTSProcessor:
             
             # 流式传输音频数据
             try:
-                audio_data = b""
+                audio_data = bytearray()
                 async for chunk in communicate.stream():
                     if chunk["type"] == "audio":
-                        audio_data += chunk["data"]
+                        audio_data.extend(chunk["data"])
                 
                 # 发送音频数据到ffmpeg
-                stdout, stderr = ffmpeg_process.communicate(input=audio_data)
+                stdout, stderr = ffmpeg_process.communicate(input=bytes(audio_data))
                 
                 if ffmpeg_process.returncode != 0:
                     print(f"❌ ffmpeg转换失败: {stderr.decode()}")
                     raise Exception("音频转换失败")
-                
-                # 确保文件完全写入完成
-                import time
-                time.sleep(0.1)  # 等待文件系统同步
+                # communicate()返回时ffmpeg已退出并关闭文件，可直接读取
                     
             except Exception as e:
                 print(f"❌ Edge-TTS音频合成失败: {e}")
@@ -437,8 +614,13 @@ class TTSProcessor:
             return None
     
     def _load_wav_file(self, file_path: str):
-        """加载WAV文件为numpy数组"""
+        """加载WAV文件为numpy数组（保持原始整数格式，sounddevice可直接播放）"""
         try:
+            if file_path.endswith(_CACHE_PCM_SUFFIX):
+                # 自有缓存格式固定为16kHz双声道int16，直接跳过44字节头读取数据
+                audio_data = np.fromfile(file_path, dtype='<i2', offset=44).reshape(-1, TTS_CHANNELS)
+                return audio_data, TTS_SAMPLERATE, TTS_CHANNELS
+            
             with wave.open(file_path, 'rb') as wav_file:
                 frames = wav_file.readframes(-1)
                 sample_rate = wav_file.getframerate()
@@ -461,30 +643,38 @@ class TTSProcessor:
                 if channels > 1:
                     audio_data = audio_data.reshape(-1, channels)
                 
-                # 转换为float32格式 (-1.0 到 1.0)
-                if sampwidth == 1:
-                    audio_data = (audio_data.astype(np.float32) - 128) / 128.0
-                elif sampwidth == 2:
-                    audio_data = audio_data.astype(np.float32) / 32768.0
-                elif sampwidth == 4:
-                    audio_data = audio_data.astype(np.float32) / 2147483648.0
-                
+                # 不再转换为float32：sounddevice原生支持uint8/int16/int32输出
                 return audio_data, sample_rate, channels
                 
         except Exception as e:
             print(f"❌ 加载WAV文件失败: {e}")
             return None, None, None
     
+    def _load_audio_for_playback(self, file_path: str):
+        """加载待播放的音频，最近播放过的直接使用内存中的PCM（LRU）"""
+        hot = self._hot_audio.get(file_path)
+        if hot is not None:
+            self._hot_audio.move_to_end(file_path)
+            return hot
+        
+        loaded = self._load_wav_file(file_path)
+        if loaded[0] is not None:
+            self._hot_audio[file_path] = loaded
+            if len(self._hot_audio) > self._hot_audio_size:
+                self._hot_audio.popitem(last=False)
+        return loaded
+    
     def _play_audio_file(self, file_path: str):
         """
         播放音频文件
         
-        优先使用sounddevice，备选aplay/pygame
+        优先使用sounddevice，备选aplay
         """
         try:
+            self._ensure_playback_device()
             if self.use_sounddevice:
                 # 使用sounddevice播放
-                audio_data, sample_rate, channels = self._load_wav_file(file_path)
+                audio_data, sample_rate, channels = self._load_audio_for_playback(file_path)
                 
                 if audio_data is not None:
                     # sounddevice播放
@@ -498,7 +688,7 @@ class TTSProcessor:
                 else:
                     print("⚠️ WAV文件加载失败，回退到备选播放器")
                     
-            # 备选方案：使用aplay或pygame
+            # 备选方案：使用aplay指定设备
             if hasattr(self, 'use_system_player') and self.use_system_player:
                 # 使用aplay播放
                 try:
@@ -525,40 +715,26 @@ class TTSProcessor:
                 except Exception as e:
                     print(f"⚠️ aplay播放错误: {e}")
             
-            # 最后备选：pygame播放
+            # 最后备选：aplay使用系统默认设备
             try:
-                pygame.mixer.music.load(file_path)
-                pygame.mixer.music.play()
-                
-                # 等待播放完成
-                while pygame.mixer.music.get_busy():
-                    if self.stop_playing.is_set():
-                        pygame.mixer.music.stop()
-                        break
-                    time.sleep(0.1)
-                # pygame播放完成
-                
+                result = subprocess.run(['aplay', '-q', file_path], capture_output=True, timeout=30)
+                if result.returncode != 0:
+                    print(f"❌ aplay播放失败: {result.stderr.decode()}")
             except Exception as e:
-                print(f"❌ pygame播放失败: {e}")
+                print(f"❌ aplay播放失败: {e}")
             
         except Exception as e:
             print(f"❌ 播放失败: {e}")
     
-    def _audio_player_thread(self):
-        """音频播放线程"""
-        while True:
-            try:
-                audio_file = self.audio_queue.get(timeout=1.0)
-                if audio_file is None:  # 结束信号
-                    break
-                
-                self._play_audio_file(audio_file)
-                self.audio_queue.task_done()
-                
-            except queue.Empty:
-                continue
-            except Exception as e:
-                print(f"❌ 播放线程错误: {e}")
+    def _start_synthesis_tasks(self, chunks: List[str], concurrency: int = 2) -> List[asyncio.Task]:
+        """为各片段创建合成任务，最多同时合成concurrency个片段"""
+        semaphore = asyncio.Semaphore(concurrency)
+        
+        async def produce(chunk):
+            async with semaphore:
+                return await self._synthesize_chunk(chunk)
+        
+        return [asyncio.create_task(produce(chunk)) for chunk in chunks]
     
     async def speak_immediate(self, text: str):
         """立即合成策略 - 适用于短文本"""
@@ -566,85 +742,197 @@ class TTSProcessor:
         
         audio_file = await self._synthesize_chunk(text)
         if audio_file:
-            self._play_audio_file(audio_file)
+            await asyncio.to_thread(self._play_audio_file, audio_file)
     
     async def speak_chunked(self, text: str):
         """分块合成策略 - 适用于中等长度文本"""
         chunks = self._split_text_semantic(text)
         print(f"🔊 分块合成: {len(chunks)} 个片段")
         
-        for i, chunk in enumerate(chunks):
-            print(f"   片段 {i+1}: {chunk}")
-            
-            audio_file = await self._synthesize_chunk(chunk)
-            if audio_file:
-                self._play_audio_file(audio_file)
-                # 片段间短暂停顿
-                time.sleep(0.2)
+        # 后续片段在当前片段播放时提前合成
+        tasks = self._start_synthesis_tasks(chunks)
+        try:
+            for i, (chunk, task) in enumerate(zip(chunks, tasks)):
+                print(f"   片段 {i+1}: {chunk}")
+                
+                audio_file = await task
+                if audio_file:
+                    # 在线程中阻塞播放，事件循环继续推进后续片段的合成
+                    await asyncio.to_thread(self._play_audio_file, audio_file)
+                    # 片段间短暂停顿
+                    await asyncio.sleep(0.2)
+        finally:
+            # 出错或被取消时取消尚未完成的合成
+            for task in tasks:
+                task.cancel()
     
     async def speak_streaming(self, text: str):
         """流式合成策略 - 适用于长文本"""
         chunks = self._split_text_semantic(text)
         print(f"🔊 流式合成: {len(chunks)} 个片段")
         
-        # 启动播放线程
-        if not self.is_playing:
-            self.is_playing = True
-            self.stop_playing.clear()
-            player_thread = threading.Thread(target=self._audio_player_thread)
-            player_thread.daemon = True
-            player_thread.start()
-        
-        # 并行合成和播放
-        for i, chunk in enumerate(chunks):
-            print(f"   流式片段 {i+1}: {chunk}")
-            
-            audio_file = await self._synthesize_chunk(chunk)
-            if audio_file:
-                self.audio_queue.put(audio_file)
+        self.stop_playing.clear()
+        
+        # 合成与播放在同一协程中衔接：后续片段并行合成，当前片段在线程中播放，不阻塞事件循环
+        tasks = self._start_synthesis_tasks(chunks)
+        try:
+            for i, (chunk, task) in enumerate(zip(chunks, tasks)):
+                print(f"   流式片段 {i+1}: {chunk}")
+                
+                audio_file = await task
+                if self.stop_playing.is_set():
+                    break
+                if audio_file:
+                    await asyncio.to_thread(self._play_audio_file, audio_file)
+        finally:
+            # 停止或出错时取消尚未完成的合成
+            for task in tasks:
+                task.cancel()
     
-    async def speak(self, text: str, strategy: Optional[str] = None):
+    async def speak(self, text: str, strategy: Optional[str] = None) -> Optional[str]:
         """
         完整语音合成 - 保证语音连贯性
         
         Args:
             text: 要合成的文本
             strategy: 合成策略（现在统一使用完整合成）
+            
+        Returns:
+            播放的音频文件路径（缓存文件），失败返回None
         """
         if not text or not text.strip():
-            return
+            return None
         
         text = text.strip()
+        # 清除上次stop()留下的停止信号，否则流式播放会立即中止
+        self.stop_playing.clear()
         
         # 静默TTS处理，减少日志噪音
         start_time = time.time()
+        audio_file = None
         
         try:
-            audio_file = await self._synthesize_chunk(text)
+            self._ensure_playback_device()
+            # 只查一次缓存，命中时直接播放该文件
+            audio_file = self._get_cached_audio(text)
             if audio_file:
-                self._play_audio_file(audio_file)
+                await asyncio.to_thread(self._play_audio_file, audio_file)
+            elif av is not None and self.use_sounddevice:
+                # 未缓存时边合成边播放，首段音频解码后即开始输出
+                audio_file = await self._speak_stream(text)
+            else:
+                audio_file = await self._synthesize_chunk(text)
+                if audio_file:
+                    await asyncio.to_thread(self._play_audio_file, audio_file)
         
         except Exception as e:
             print(f"❌ TTS处理失败: {e}")
         
         # 静默完成，不显示处理时间
         elapsed_time = time.time() - start_time
+        return audio_file
+    
+    def prewarm(self, texts: List[str]):
+        """
+        后台预热：启动时合成常用语句并写入缓存
+        
+        首次合成需要建立DNS解析、加载证书和TLS握手等冷启动开销，
+        提前在后台完成，避免第一次回复时才承担这部分延迟
+        """
+        async def warm():
+            try:
+                for text in texts:
+                    if not self._get_cached_audio(text):
+                        await self._synthesize_chunk(text)
+            except Exception as e:
+                print(f"⚠️ TTS预热失败: {e}")
+        
+        _TTS_LOOP.submit(warm())
+    
+    async def _speak_stream(self, text: str) -> Optional[str]:
+        """
+        流式合成并播放：Edge-TTS的MP3分片到达即增量解码送入输出流，
+        播放结束后将完整PCM写入缓存
+        
+        Returns:
+            缓存文件路径，失败返回None
+        """
+        communicate = edge_tts.Communicate(text, self.voice, rate=self.rate, volume=self.volume)
+        decode = self._create_mp3_decoder()
+        
+        pcm_queue = queue.Queue()  # 解码线程 -> 播放回调，None表示结束
+        pcm_parts = []  # 完整PCM，播放结束后写入缓存
+        pending = [np.empty((0, TTS_CHANNELS), dtype=np.int16)]  # 回调中上次未播完的数据
+        finished = threading.Event()
+        
+        def callback(outdata, frames, time_info, status):
+            if self.stop_playing.is_set():
+                raise sd.CallbackAbort
+            filled = 0
+            buf = pending[0]
+            while filled < frames:
+                if len(buf) == 0:
+                    try:
+                        buf = pcm_queue.get_nowait()
+                    except queue.Empty:
+                        break  # 解码跟不上时本块剩余部分输出静音
+                    if buf is None:
+                        outdata[filled:] = 0
+                        raise sd.CallbackStop
+                n = min(frames - filled, len(buf))
+                outdata[filled:filled + n] = buf[:n]
+                buf = buf[n:]
+                filled += n
+            if filled < frames:
+                outdata[filled:] = 0
+            pending[0] = buf
+        
+        def emit(pcm_list):
+            for pcm in pcm_list:
+                pcm_parts.append(pcm)
+                pcm_queue.put(pcm)
+        
+        stream = None
+        try:
+            async for chunk in communicate.stream():
+                if chunk["type"] != "audio":
+                    continue
+                emit(decode(chunk["data"]))
+                if stream is None and pcm_parts:
+                    # 第一段PCM就绪后再打开输出流，避免开头播放静音
+                    stream = sd.OutputStream(
+                        samplerate=TTS_SAMPLERATE,
+                        channels=TTS_CHANNELS,
+                        dtype='int16',
+                        device=self.audio_device_id,
+                        blocksize=1024,
+                        callback=callback,
+                        finished_callback=finished.set
+                    )
+                    stream.start()
+            
+            # 取出解码器和重采样器中剩余的数据
+            emit(decode(None))
+            pcm_queue.put(None)
+            
+            if stream is None:
+                print("❌ 生成的音频文件为空")
+                return None
+            # 在线程中等待播放结束，不阻塞共用事件循环上的其他合成任务
+            await asyncio.to_thread(finished.wait)
+        finally:
+            if stream is not None:
+                stream.close()
+        
+        return self._cache_pcm(text, np.concatenate(pcm_parts))
     
     def stop(self):
         """停止TTS播放"""
         self.stop_playing.set()
         try:
-            if pygame.mixer.get_init():
-                pygame.mixer.music.stop()
-        except:
-            pass  # 静默处理mixer未初始化的错误
-        
-        # 清空队列（不删除缓存文件）
-        while not self.audio_queue.empty():
-            try:
-                self.audio_queue.get_nowait()
-            except:
-                break
+            sd.stop()  # 流式播放由回调检测停止信号自行中止
+        except Exception:
+            pass  # 静默处理未在播放的情况
         
         print("🛑 TTS播放已停止")
     
@@ -657,7 +945,8 @@ class TTSProcessor:
             
             # 清空索引
             self.cache_index.clear()
-            self._save_cache_index()
+            self._hot_audio.clear()
+            self._mark_dirty()
             
             # 静默清空音频缓存
             pass
@@ -706,15 +995,22 @@ class TTSProcessor:
         except:
             return ["zh-CN-XiaoxiaoNeural"]
 
+class _LoopThread:
+    """常驻后台线程的事件循环，所有TTS协程都调度到同一个循环上执行"""
+    
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, daemon=True).start()
+    
+    def submit(self, coro):
+        """提交协程，返回concurrent.futures.Future"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+_TTS_LOOP = _LoopThread()
+
 # 异步包装函数
 def run_tts_async(coro):
-    """运行异步TTS函数的辅助函数"""
-    try:
-        loop = asyncio.get_event_loop()
-    except RuntimeError:
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-    
-    return loop.run_until_complete(coro)
+    """运行异步TTS函数的辅助函数（在常驻事件循环上执行并等待结果）"""
+    return _TTS_LOOP.submit(coro).result()
 
 
@@ -16,9 +16,14 @@ class VADProcessor:
             samplerate: 采样率
             channels: 声道数
         """
+        if samplerate not in (8000, 16000, 32000, 48000):
+            raise ValueError(f"WebRTC VAD不支持的采样率: {samplerate}Hz (仅支持8000/16000/32000/48000)")
+        
         self.vad_mode = vad_mode
         self.samplerate = samplerate
         self.channels = channels
+        # 20ms检测块的采样点数（WebRTC VAD支持10/20/30ms）
+        self._frame_samples = samplerate // 50
         
         # 初始化 WebRTC VAD
         self.vad = webrtcvad.Vad()
@@ -26,18 +31,18 @@ class VADProcessor:
         
         print(f'🎯 VAD初始化完成: 模式={vad_mode}, 采样率={samplerate}Hz, 声道={channels}')
     
+    def _stereo_to_mono_array(self, stereo_data):
+        """将双声道音频转换为单声道int16数组（连续内存）"""
+        audio_array = np.frombuffer(stereo_data, dtype=np.int16)
+        if self.channels == 2:
+            # 交错排列 [左, 右, 左, 右, ...]，只取左声道，避免平均造成的音质损失
+            return np.ascontiguousarray(audio_array[::2])
+        return audio_array
+    
     def stereo_to_mono(self, stereo_data):
         """将双声道音频转换为单声道 - 修复音质问题"""
         try:
-            audio_array = np.frombuffer(stereo_data, dtype=np.int16)
-            if self.channels == 2:
-                # 重塑为双声道数组 [左, 右, 左, 右, ...]
-                stereo_array = audio_array.reshape(-1, 2)
-                # 只取左声道，避免平均造成的音质损失
-                mono_array = stereo_array[:, 0]  # 取左声道
-            else:
-                mono_array = audio_array
-            return mono_array.tobytes()
+            return self._stereo_to_mono_array(stereo_data).tobytes()
         except Exception as e:
             print(f"❌ 双声道转单声道失败: {e}")
             return stereo_data
@@ -51,42 +56,42 @@ class VADProcessor:
             
         Returns:
             tuple: (是否检测到语音, 语音块数, 总块数)
+            结果确定后提前结束检测，此时语音块数为已检测到的块数
         """
         try:
-            # 双声道转单声道用于VAD检测
-            mono_data = self.stereo_to_mono(audio_data)
+            # 双声道转单声道用于VAD检测，直接使用数组，仅在送入VAD时逐块转为bytes
+            mono_array = self._stereo_to_mono_array(audio_data)
             
-            # 检查数据长度
-            if len(mono_data) < 640:  # 至少20ms的数据
-                return False, 0, 0
-            
-            # 将音频数据分块检测，设置有效激活率rate=50%
+            # 将音频数据按20ms分块检测，设置有效激活率rate=50%
             num, rate = 0, 0.5
-            step = int(self.samplerate * 0.02) * 2  # 20ms 块大小 * 2字节(int16)
-            
-            # 确保步长不为0
-            if step <= 0:
-                step = 640  # 默认640字节 (20ms @ 16kHz，安全后备值)
+            frame_samples = self._frame_samples
             
-            total_chunks = len(mono_data) // step
+            # 检查数据长度（至少20ms的数据）
+            total_chunks = mono_array.size // frame_samples
             if total_chunks == 0:
                 return False, 0, 0
                 
             flag_rate = max(1, round(rate * total_chunks))  # 至少需要1个块
-
-            for i in range(0, len(mono_data), step):
-                chunk = mono_data[i:i + step]
-                if len(chunk) == step:
-                    try:
-                        if self.vad.is_speech(chunk, sample_rate=self.samplerate):
-                            num += 1
-                    except Exception:
-                        # VAD检测失败时跳过该块，静默处理保证稳定性
-                        continue
-
-            is_speech = num >= flag_rate
             
-            return is_speech, num, total_chunks
+            # 一次切分为 (块数, 块大小) 矩阵，逐行送入VAD
+            frames = mono_array[:total_chunks * frame_samples].reshape(total_chunks, frame_samples)
+            vad_is_speech = self.vad.is_speech
+            sr = self.samplerate
+            
+            for i, row in enumerate(frames):
+                try:
+                    if vad_is_speech(row.tobytes(), sr):
+                        num += 1
+                        if num >= flag_rate:
+                            return True, num, total_chunks
+                except Exception:
+                    # VAD检测失败时跳过该块，静默处理保证稳定性
+                    pass
+                # 剩余块全部为语音也达不到阈值时提前结束
+                if num + (total_chunks - i - 1) < flag_rate:
+                    break
+            
+            return False, num, total_chunks
             
         except Exception as e:
             print(f"❌ VAD检测错误: {e}")
@@ -95,6 +100,9 @@ class VADProcessor:
     def calculate_audio_amplitude(self, audio_data):
         """计算音频幅度"""
         audio_array = np.frombuffer(audio_data, dtype=np.int16)
-        max_amplitude = np.max(np.abs(audio_array))
+        if audio_array.size == 0:
+            return 0.0
+        # 由最大值和最小值直接得出峰值，不生成abs临时数组（也避免-32768取abs溢出）
+        max_amplitude = max(int(audio_array.max()), -int(audio_array.min()))
         normalized_amplitude = max_amplitude / 32768.0
         return normalized_amplitude